@@ -0,0 +1,243 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import struct
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Segment file layout (little endian, every section 8-byte aligned):
+#   magic | header (count, categories_len, blob_len) | categories JSON
+#   | created_at float64[count] | amount float64[count] | category uint16[count]
+#   | record offsets uint64[count + 1] | records (concatenated JSON)
+# Records are sorted by created_at so range queries can binary-search the
+# timestamp column and only touch the pages that hold matching rows.
+MAGIC = b"EXSEG001"
+HEADER = struct.Struct("<QQQ")
+
+
+def to_timestamp(value: str) -> float:
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp()
+
+
+def month_of(value: str) -> str:
+    return value[:7]
+
+
+def hot_cutoff(months: int) -> str:
+    """First month (YYYY-MM) of the `months`-month hot window ending now."""
+    now = datetime.utcnow()
+    year, month = divmod(now.year * 12 + now.month - 1 - (months - 1), 12)
+    return f"{year:04d}-{month + 1:02d}"
+
+
+def _pad(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class Segment:
+    """One sealed, immutable month of expenses, read through mmap."""
+
+    def __init__(self, path: str, summary: Dict[str, Any]):
+        self.path = path
+        self.summary = summary
+        self._file = None
+        self._map = None
+
+    def _open(self):
+        if self._map is not None:
+            return
+        self._file = open(self.path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        if bytes(view[:8]) != MAGIC:
+            raise ValueError(f"Not an expense segment: {self.path}")
+        count, categories_len, _ = HEADER.unpack_from(view, 8)
+        pos = 8 + HEADER.size
+        self.categories = json.loads(bytes(view[pos:pos + categories_len]))
+        pos += _pad(categories_len)
+        self.timestamps = view[pos:pos + 8 * count].cast("d")
+        pos += 8 * count
+        self.amounts = view[pos:pos + 8 * count].cast("d")
+        pos += 8 * count
+        self.category_ids = view[pos:pos + 2 * count].cast("H")
+        pos += _pad(2 * count)
+        self.offsets = view[pos:pos + 8 * (count + 1)].cast("Q")
+        self.blob_start = pos + 8 * (count + 1)
+        self.count = count
+
+    def close(self):
+        if self._map is not None:
+            for name in ("timestamps", "amounts", "category_ids", "offsets"):
+                getattr(self, name).release()
+            self._map.close()
+            self._file.close()
+            self._map = None
+
+    def overlaps(self, start: Optional[float], end: Optional[float]) -> bool:
+        if start is not None and self.summary["max_ts"] < start:
+            return False
+        if end is not None and self.summary["min_ts"] >= end:
+            return False
+        return True
+
+    def covered_by(self, start: Optional[float], end: Optional[float]) -> bool:
+        return ((start is None or self.summary["min_ts"] >= start)
+                and (end is None or self.summary["max_ts"] < end))
+
+    def _bounds(self, start: Optional[float], end: Optional[float]) -> Tuple[int, int]:
+        self._open()
+        lo = 0 if start is None else bisect.bisect_left(self.timestamps, start)
+        hi = self.count if end is None else bisect.bisect_left(self.timestamps, end)
+        return lo, hi
+
+    def records(self, start: Optional[float] = None, end: Optional[float] = None,
+                category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        lo, hi = self._bounds(start, end)
+        category_id = self.categories.index(category) if category in self.categories else None
+        if category is not None and category_id is None:
+            return
+        for i in range(lo, hi):
+            if category_id is not None and self.category_ids[i] != category_id:
+                continue
+            a, b = self.offsets[i], self.offsets[i + 1]
+            yield json.loads(self._map[self.blob_start + a:self.blob_start + b])
+
+    def aggregate(self, start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, Any]:
+        if self.covered_by(start, end):
+            # Whole segment: answered from the summary without opening the file
+            return {"count": self.summary["count"], "total": self.summary["total"],
+                    "by_category": dict(self.summary["by_category"])}
+        lo, hi = self._bounds(start, end)
+        by_category: Dict[str, float] = {}
+        total = 0.0
+        for i in range(lo, hi):
+            name = self.categories[self.category_ids[i]]
+            by_category[name] = by_category.get(name, 0) + self.amounts[i]
+            total += self.amounts[i]
+        return {"count": hi - lo, "total": total, "by_category": by_category}
+
+
+class ExpenseArchive:
+    """Cold storage for expenses older than the hot window.
+
+    Each month is sealed into its own segment file plus a small JSON summary
+    (row count, min/max created_at and amount, per-category totals). Only the
+    summaries are kept in memory; segment bodies are memory-mapped on demand,
+    so queries skip months outside the requested range and resident memory
+    does not grow with history.
+    """
+
+    def __init__(self, root: str = "archive"):
+        self.root = root
+        self.segments: Dict[str, Segment] = {}
+        os.makedirs(root, exist_ok=True)
+        for name in sorted(os.listdir(root)):
+            if name.endswith(".meta.json"):
+                month = name[:-len(".meta.json")]
+                with open(os.path.join(root, name)) as f:
+                    summary = json.load(f)
+                self.segments[month] = Segment(self._segment_path(month), summary)
+
+    def _segment_path(self, month: str) -> str:
+        return os.path.join(self.root, f"{month}.seg")
+
+    def __len__(self):
+        return sum(seg.summary["count"] for seg in self.segments.values())
+
+    def seal(self, expenses: List[Dict[str, Any]], before_month: str) -> List[Dict[str, Any]]:
+        """Move expenses created before `before_month` (YYYY-MM) into segments.
+
+        Returns the expenses that stay hot. Late arrivals for an already
+        sealed month are merged by writing a replacement segment.
+        """
+        hot, cold = [], {}
+        for expense in expenses:
+            month = month_of(expense["created_at"])
+            if month < before_month:
+                cold.setdefault(month, []).append(expense)
+            else:
+                hot.append(expense)
+        for month, rows in cold.items():
+            if month in self.segments:
+                rows = list(self.segments[month].records()) + rows
+                self.segments[month].close()
+            self._write_segment(month, rows)
+        return hot
+
+    def _write_segment(self, month: str, rows: List[Dict[str, Any]]):
+        rows.sort(key=lambda e: to_timestamp(e["created_at"]))
+        categories = sorted({e["category"] for e in rows})
+        category_index = {name: i for i, name in enumerate(categories)}
+        blobs = [json.dumps(e, separators=(",", ":")).encode() for e in rows]
+        offsets = [0]
+        for blob in blobs:
+            offsets.append(offsets[-1] + len(blob))
+        categories_json = json.dumps(categories).encode()
+        count = len(rows)
+
+        path = self._segment_path(month)
+        with open(path + ".tmp", "wb") as f:
+            f.write(MAGIC)
+            f.write(HEADER.pack(count, len(categories_json), offsets[-1]))
+            f.write(categories_json.ljust(_pad(len(categories_json)), b"\0"))
+            f.write(struct.pack(f"<{count}d", *(to_timestamp(e["created_at"]) for e in rows)))
+            f.write(struct.pack(f"<{count}d", *(float(e["amount"]) for e in rows)))
+            ids = struct.pack(f"<{count}H", *(category_index[e["category"]] for e in rows))
+            f.write(ids.ljust(_pad(len(ids)), b"\0"))
+            f.write(struct.pack(f"<{count + 1}Q", *offsets))
+            for blob in blobs:
+                f.write(blob)
+        os.replace(path + ".tmp", path)
+
+        by_category: Dict[str, float] = {}
+        for e in rows:
+            by_category[e["category"]] = by_category.get(e["category"], 0) + e["amount"]
+        summary = {
+            "month": month,
+            "count": count,
+            "total": sum(e["amount"] for e in rows),
+            "min_ts": to_timestamp(rows[0]["created_at"]),
+            "max_ts": to_timestamp(rows[-1]["created_at"]),
+            "min_amount": min(e["amount"] for e in rows),
+            "max_amount": max(e["amount"] for e in rows),
+            "by_category": by_category,
+        }
+        with open(os.path.join(self.root, f"{month}.meta.json"), "w") as f:
+            json.dump(summary, f, indent=2)
+        self.segments[month] = Segment(path, summary)
+
+    def _candidates(self, start: Optional[float], end: Optional[float],
+                    category: Optional[str] = None) -> Iterator[Segment]:
+        for month in sorted(self.segments):
+            seg = self.segments[month]
+            if not seg.overlaps(start, end):
+                continue
+            if category is not None and category not in seg.summary["by_category"]:
+                continue
+            yield seg
+
+    def records(self, start: Optional[float] = None, end: Optional[float] = None,
+                category: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Archived expenses in [start, end), oldest first."""
+        for seg in self._candidates(start, end, category):
+            yield from seg.records(start, end, category)
+
+    def find(self, record_id: str, ts: float) -> Optional[Dict[str, Any]]:
+        """The archived expense `record_id`, created at timestamp `ts`."""
+        # Rows are sorted by timestamp, so this decodes only rows created at `ts`
+        return next((e for e in self.records(ts, math.nextafter(ts, math.inf)) if e["id"] == record_id), None)
+
+    def aggregate(self, start: Optional[float] = None, end: Optional[float] = None) -> Dict[str, Any]:
+        result = {"count": 0, "total": 0.0, "by_category": {}}
+        for seg in self._candidates(start, end):
+            part = seg.aggregate(start, end)
+            result["count"] += part["count"]
+            result["total"] += part["total"]
+            for name, amount in part["by_category"].items():
+                result["by_category"][name] = result["by_category"].get(name, 0) + amount
+        return result
@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import os
+import re
+import uuid
+from urllib.parse import quote
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+import anyio
+from multipart.multipart import MultipartParser, parse_options_header
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    from PIL import Image
+except ImportError:  # Thumbnails are skipped without Pillow
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+THUMBNAIL_SIZE = (256, 256)
+
+# Leading bytes of the receipt formats we accept
+SIGNATURES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"%PDF-": "application/pdf",
+    b"GIF8": "image/gif",
+}
+
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+UNSAFE_FILENAME_RE = re.compile(r'[^\x20-\x7e]|["\\]')
+
+
+class UploadError(Exception):
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def sniff_type(head: bytes) -> Optional[str]:
+    for signature, content_type in SIGNATURES.items():
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def content_disposition(filename: str, kind: str = "inline") -> str:
+    """Header value for a client-supplied filename.
+
+    Headers are latin-1 and the name is untrusted, so the plain `filename` is
+    an ASCII fallback with quotes, backslashes and control characters
+    replaced; the real name goes in an RFC 5987 `filename*` parameter.
+    """
+    fallback = UNSAFE_FILENAME_RE.sub("_", filename).strip() or "receipt"
+    return f"{kind}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def extract_metadata(path: str, thumbnail_path: str) -> Dict[str, Any]:
+    """Inspect a stored receipt and write its thumbnail. Runs in a worker process."""
+    with open(path, "rb") as f:
+        head = f.read(16)
+    metadata: Dict[str, Any] = {"content_type": sniff_type(head), "size": os.path.getsize(path),
+                                "thumbnail": False}
+    if Image is None or not (metadata["content_type"] or "").startswith("image/"):
+        return metadata
+    try:
+        with Image.open(path) as image:
+            metadata["width"], metadata["height"] = image.size
+            image.thumbnail(THUMBNAIL_SIZE)
+            image.convert("RGB").save(thumbnail_path + ".tmp", "JPEG", quality=80)
+        os.replace(thumbnail_path + ".tmp", thumbnail_path)
+        metadata["thumbnail"] = True
+    except OSError:
+        pass
+    return metadata
+
+
+class ReceiptStore:
+    """Content-addressed receipt files.
+
+    Uploads are parsed straight off the request stream and written to a temp
+    file chunk by chunk while being hashed, then moved to
+    blobs/<sha[:2]>/<sha>. A file whose hash already exists is not stored
+    twice. Metadata extraction and thumbnails run in a process pool.
+    """
+
+    def __init__(self, root: str = "attachments", max_bytes: int = 20 * 1024 * 1024, workers: int = 2):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self._pool: Optional[ProcessPoolExecutor] = None
+        for sub in ("blobs", "thumbs", "tmp"):
+            os.makedirs(os.path.join(root, sub), exist_ok=True)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "blobs", sha256[:2], sha256)
+
+    def thumbnail_path(self, sha256: str) -> str:
+        return os.path.join(self.root, "thumbs", f"{sha256}.jpg")
+
+    async def receive(self, request: Request, field: str = "file",
+                      quota_bytes: Optional[int] = None) -> Dict[str, Any]:
+        """Stream the `field` file part of a multipart request into the store.
+
+        `quota_bytes` is what the uploader has left of their storage quota;
+        larger uploads are cut off with 403 while streaming.
+        """
+        content_type, params = parse_options_header(request.headers.get("content-type", ""))
+        if content_type != b"multipart/form-data" or b"boundary" not in params:
+            raise UploadError("Expected multipart/form-data")
+
+        tmp_path = os.path.join(self.root, "tmp", uuid.uuid4().hex)
+        state: Dict[str, Any] = {"headers": {}, "field": b"", "value": b"", "receiving": False, "done": False,
+                                 "pending": [], "out": None, "size": 0, "head": b"", "filename": None,
+                                 "content_type": None}
+        hasher = hashlib.sha256()
+
+        def on_header_field(data, start, end):
+            state["field"] += data[start:end]
+
+        def on_header_value(data, start, end):
+            state["value"] += data[start:end]
+
+        def on_header_end():
+            state["headers"][state["field"].lower()] = state["value"]
+            state["field"], state["value"] = b"", b""
+
+        def on_headers_finished():
+            _, disposition = parse_options_header(state["headers"].get(b"content-disposition", b""))
+            if disposition.get(b"name") == field.encode() and b"filename" in disposition and not state["done"]:
+                state["filename"] = disposition[b"filename"].decode(errors="replace")
+                state["content_type"] = state["headers"].get(b"content-type", b"").decode() or None
+                state["receiving"] = True
+
+        def on_part_data(data, start, end):
+            if not state["receiving"]:
+                return
+            chunk = data[start:end]
+            state["size"] += len(chunk)
+            if state["size"] > self.max_bytes:
+                raise UploadError("Receipt is too large", 413)
+            if quota_bytes is not None and state["size"] > quota_bytes:
+                raise UploadError("Storage quota exceeded", 403)
+            if len(state["head"]) < 16:
+                state["head"] += chunk[:16]
+            state["pending"].append(chunk)
+
+        def on_part_end():
+            if state["receiving"]:
+                state["receiving"] = False
+                state["done"] = True
+            state["headers"] = {}
+
+        def write_pending():
+            # Parser callbacks only collect the file's bytes; hashing and disk
+            # writes run here, in a worker thread, between reads of the body
+            pending, state["pending"] = state["pending"], []
+            if state["out"] is None:
+                state["out"] = open(tmp_path, "wb")
+            for chunk in pending:
+                hasher.update(chunk)
+                state["out"].write(chunk)
+
+        parser = MultipartParser(params[b"boundary"], {
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        })
+        try:
+            async for chunk in request.stream():
+                parser.write(chunk)
+                if state["pending"]:
+                    await anyio.to_thread.run_sync(write_pending)
+            parser.finalize()
+            if not state["done"]:
+                raise UploadError(f"No file in form field '{field}'")
+            await anyio.to_thread.run_sync(write_pending)
+            state["out"].close()
+            state["out"] = None
+            sniffed = sniff_type(state["head"])
+            if sniffed is None:
+                raise UploadError("Receipts must be JPEG, PNG, GIF, WebP or PDF files", 415)
+        except BaseException:
+            if state["out"] is not None:
+                state["out"].close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+        sha256 = hasher.hexdigest()
+        path = self.blob_path(sha256)
+        existed = os.path.exists(path)
+        if existed:
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return {"sha256": sha256, "size": state["size"], "filename": state["filename"],
+                "content_type": sniffed, "stored": not existed}
+
+    def discard(self, sha256: str):
+        """Remove a blob stored by an upload that was then rejected."""
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            os.remove(path)
+
+    async def describe(self, sha256: str) -> Dict[str, Any]:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.workers)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, extract_metadata,
+                                          self.blob_path(sha256), self.thumbnail_path(sha256))
+
+
+def parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single `bytes=` range into an inclusive (start, end) pair.
+
+    Returns None when there is no usable Range header; raises ValueError for
+    ranges that cannot be satisfied.
+    """
+    if not header:
+        return None
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":
+        length = int(last)
+        if length == 0:
+            raise ValueError("Empty suffix range")
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """File response with single-range support.
+
+    Uses the ASGI zero-copy extension (sendfile) when the server offers it and
+    falls back to chunked reads in a worker thread otherwise.
+    """
+
+    def __init__(self, path: str, range_header: Optional[str] = None, media_type: Optional[str] = None,
+                 etag: Optional[str] = None, filename: Optional[str] = None):
+        self.path = path
+        size = os.path.getsize(path)
+        headers = {"accept-ranges": "bytes"}
+        if etag:
+            headers["etag"] = f'"{etag}"'
+            # Content-addressed: the bytes behind a hash never change
+            headers["cache-control"] = "private, max-age=31536000, immutable"
+        if filename:
+            headers["content-disposition"] = content_disposition(filename)
+        try:
+            byte_range = parse_range(range_header, size)
+        except ValueError:
+            super().__init__(status_code=416, headers={**headers, "content-range": f"bytes */{size}"})
+            self.start, self.length = 0, 0
+            return
+        if byte_range is None:
+            self.start, self.length = 0, size
+            status_code = 200
+        else:
+            self.start, self.length = byte_range[0], byte_range[1] - byte_range[0] + 1
+            headers["content-range"] = f"bytes {byte_range[0]}-{byte_range[1]}/{size}"
+            status_code = 206
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.headers["content-length"] = str(self.length)
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        if scope.get("method") == "HEAD" or self.length == 0:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        with open(self.path, "rb") as f:
+            if "http.response.zerocopy" in scope.get("extensions", {}):
+                await send({"type": "http.response.zerocopy", "file": f.fileno(),
+                            "offset": self.start, "count": self.length, "more_body": False})
+                return
+            f.seek(self.start)
+            remaining = self.length
+            while remaining:
+                chunk = await anyio.to_thread.run_sync(f.read, min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                await send({"type": "http.response.body", "body": chunk, "more_body": remaining > 0})
+            if remaining:
+                await send({"type": "http.response.body", "body": b"", "more_body": False})
@@ -0,0 +1,104 @@
+"""Benchmark: per-tenant partitions vs. one global list.
+
+Builds 1,000 tenants whose sizes follow a Zipf distribution (a handful of
+very large companies, a long tail of small ones) and times the admin API's
+hot paths for small tenants while the large ones are present:
+
+    python bench_tenants.py [--tenants 1000] [--expenses 500000]
+"""
+import argparse
+import random
+import statistics
+import tempfile
+import time
+import uuid
+
+from tenants import TenantQuota, TenantStore
+
+CATEGORIES = ["Travel", "Meals", "Accommodation", "Office Supplies", "Transport"]
+WORDS = ["hotel", "uber", "taxi", "flight", "lunch", "dinner", "team", "client", "train", "parking"]
+
+
+def skewed_sizes(tenants: int, total: int, s: float = 1.1):
+    weights = [1 / (rank + 1) ** s for rank in range(tenants)]
+    scale = total / sum(weights)
+    return [max(1, int(w * scale)) for w in weights]
+
+
+def timed(func, repeat: int):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tenants", type=int, default=1000)
+    parser.add_argument("--expenses", type=int, default=500_000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    random.seed(42)
+    sizes = skewed_sizes(args.tenants, args.expenses)
+    store = TenantStore(root=tempfile.mkdtemp(), archive_root=tempfile.mkdtemp(),
+                        quota=TenantQuota(max_records=10 ** 9))
+    everything = []
+    started = time.perf_counter()
+    for company, size in enumerate(sizes):
+        tenant = store.get(str(company))
+        for _ in range(size):
+            expense = {
+                "id": str(uuid.uuid4()),
+                "user_id": f"user{random.randrange(50)}",
+                "amount": round(random.uniform(5, 500), 2),
+                "category": random.choice(CATEGORIES),
+                "description": " ".join(random.sample(WORDS, 2)),
+                "status": "pending",
+                "created_at": "2026-10-01T00:00:00",
+            }
+            tenant.add("expenses", expense)
+            everything.append(expense)
+    print(f"built {args.tenants} tenants / {len(everything)} expenses in {time.perf_counter() - started:.1f}s")
+    print(f"largest tenant: {sizes[0]} expenses, median tenant: {statistics.median(sizes):.0f}")
+
+    small = [str(c) for c in range(args.tenants // 2, args.tenants)]
+    target = lambda: random.choice(small)
+
+    def global_list():
+        company = target()
+        return [e for e in everything if e["company_id"] == company]
+
+    def global_analyze():
+        company = target()
+        total, by_category = 0.0, {}
+        for e in everything:
+            if e["company_id"] == company:
+                total += e["amount"]
+                by_category[e["category"]] = by_category.get(e["category"], 0) + e["amount"]
+        return total, by_category
+
+    def global_lookup():
+        company = target()
+        expense_id = store.get(company).data["expenses"][0]["id"]
+        return next(e for e in everything if e["id"] == expense_id)
+
+    rows = [
+        ("list expenses", global_list, lambda: store.get(target()).data["expenses"]),
+        ("analyze", global_analyze, lambda: store.get(target()).expense_summary()),
+        ("get by id", global_lookup,
+         lambda: (lambda t: t.get("expenses", t.data["expenses"][0]["id"]))(store.get(target()))),
+        ("search 'hotel'", None, lambda: store.get(target()).search.search("hotel")),
+    ]
+    print(f"\n{'small-tenant request':<22}{'global p50/p99 ms':>22}{'partitioned p50/p99 ms':>26}")
+    for name, baseline, partitioned in rows:
+        base = "n/a" if baseline is None else "%.3f / %.3f" % timed(baseline, max(5, args.repeat // 20))
+        part = "%.3f / %.3f" % timed(partitioned, args.repeat)
+        print(f"{name:<22}{base:>22}{part:>26}")
+
+
+if __name__ == "__main__":
+    main()
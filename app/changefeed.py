@@ -0,0 +1,174 @@
+import asyncio
+import itertools
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Iterable, List, Optional, Tuple
+
+# Topic filters a client may subscribe with; each maps to a field on the event
+TOPIC_FIELDS = ("collection", "company", "status")
+
+
+def diff_record(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """Return only the fields of `new` that differ from `old`."""
+    return {k: v for k, v in new.items() if old.get(k) != v}
+
+
+class Subscription:
+    """A single client's view of the feed.
+
+    Events are buffered per (collection, id) so that a slow consumer only ever
+    sees the latest delta for a record. If even the coalesced buffer grows past
+    `max_pending` the buffer is dropped and the client is told to resync.
+    """
+
+    def __init__(self, feed: "ChangeFeed", topics: Dict[str, Optional[set]], max_pending: int):
+        self.feed = feed
+        self.topics = topics
+        self.max_pending = max_pending
+        self.pending: "OrderedDict[Tuple[str, str], Dict[str, Any]]" = OrderedDict()
+        self.needs_resync = False
+        self._ready = asyncio.Event()
+
+    def matches(self, event: Dict[str, Any]) -> bool:
+        for field in TOPIC_FIELDS:
+            wanted = self.topics.get(field)
+            value = event.get(field)
+            if wanted and (value is None or str(value) not in wanted):
+                return False
+        return True
+
+    def push(self, event: Dict[str, Any]):
+        if self.needs_resync or not self.matches(event):
+            return
+        key = (event["collection"], event["id"])
+        previous = self.pending.pop(key, None)
+        if previous is not None:
+            event = self._coalesce(previous, event)
+            if event is None:
+                return
+        self.pending[key] = event
+        if len(self.pending) > self.max_pending:
+            self.pending.clear()
+            self.needs_resync = True
+        self._ready.set()
+
+    @staticmethod
+    def _coalesce(old: Dict[str, Any], new: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        if new["op"] == "delete":
+            # Created and deleted before the client saw it: nothing to send
+            return None if old["op"] == "create" else new
+        merged = dict(new)
+        merged["data"] = {**old.get("data", {}), **new.get("data", {})}
+        if old["op"] == "create":
+            merged["op"] = "create"
+        return merged
+
+    async def next_batch(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Wait for pending events and drain them. Returns [] on timeout.
+
+        After an overflow the batch is a single `resync` event carrying the
+        current sequence number; the client should reload and resume from it.
+        """
+        if not self.pending and not self.needs_resync:
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        if self.needs_resync:
+            self.needs_resync = False
+            self.pending.clear()
+            return [{"op": "resync", "seq": self.feed.last_seq, "cursor": self.feed.cursor()}]
+        batch = list(self.pending.values())
+        self.pending.clear()
+        return batch
+
+
+class ChangeFeed:
+    """In-process broadcaster for compact mutation deltas.
+
+    Every event carries a monotonically increasing `seq`; the most recent
+    `history_size` events are kept so reconnecting clients can resume from the
+    last sequence number they saw. Sequence numbers restart with the process,
+    so clients resume with a `cursor` ("<epoch>.<seq>") and a cursor from an
+    earlier process gets a resync instead of a silent gap.
+    """
+
+    def __init__(self, history_size: int = 10000, max_pending: int = 1000):
+        self.history: Deque[Dict[str, Any]] = deque(maxlen=history_size)
+        self.max_pending = max_pending
+        self.subscribers: List[Subscription] = []
+        self._seq = itertools.count(1)
+        self.last_seq = 0
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def cursor(self, seq: Optional[int] = None) -> str:
+        return f"{self.epoch}.{self.last_seq if seq is None else seq}"
+
+    def parse_cursor(self, value: Optional[str]) -> Optional[int]:
+        """Sequence number a resume cursor points at in this process.
+
+        Returns None for no cursor and -1 for one that this process can't
+        honour (another epoch, or a bare seq past the current one).
+        """
+        if not value:
+            return None
+        epoch, _, seq = value.rpartition(".")
+        if not seq.isdigit() or (epoch and epoch != self.epoch):
+            return -1
+        if int(seq) > self.last_seq:
+            return -1
+        return int(seq)
+
+    def publish(self, collection: str, op: str, record: Dict[str, Any],
+                data: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Record a mutation and fan it out to all matching subscribers.
+
+        `data` is the delta to ship; it defaults to the full record for
+        creates and to nothing for deletes.
+        """
+        if data is None:
+            data = {} if op == "delete" else dict(record)
+        self.last_seq = next(self._seq)
+        event = {
+            "seq": self.last_seq,
+            "cursor": self.cursor(),
+            "ts": datetime.utcnow().isoformat(),
+            "collection": collection,
+            "op": op,
+            "id": record["id"],
+            "company": record.get("company_id"),
+            "status": record.get("status"),
+            "data": data,
+        }
+        self.history.append(event)
+        for sub in self.subscribers:
+            sub.push(event)
+        return event
+
+    def subscribe(self, topics: Optional[Dict[str, Iterable[str]]] = None,
+                  since: Optional[str] = None) -> Subscription:
+        """Register a subscriber, replaying history after the `since` cursor if given."""
+        topics = {k: set(v) for k, v in (topics or {}).items() if v and k in TOPIC_FIELDS}
+        sub = Subscription(self, topics, self.max_pending)
+        since = self.parse_cursor(since)
+        if since == -1:
+            sub.needs_resync = True
+            sub._ready.set()
+        elif since is not None and since < self.last_seq:
+            oldest = self.history[0]["seq"] if self.history else self.last_seq + 1
+            if since + 1 < oldest:
+                # The gap has already been evicted from history
+                sub.needs_resync = True
+                sub._ready.set()
+            else:
+                for event in self.history:
+                    if event["seq"] > since:
+                        sub.push(event)
+        self.subscribers.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        if sub in self.subscribers:
+            self.subscribers.remove(sub)
@@ -1,14 +1,26 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Request
+from fastapi import FastAPI, HTTPException, Depends, Header, status, Request, Response, WebSocket, WebSocketDisconnect, WebSocketException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from starlette.requests import HTTPConnection
 from pydantic import BaseModel, EmailStr
+from jose import JWTError, jwt
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+import asyncio
+import math
 import uuid
 import json
 import os
 
+from archive import hot_cutoff, to_timestamp
+from attachments import RangeFileResponse, ReceiptStore, UploadError
+from changefeed import ChangeFeed, diff_record
+from org_hierarchy import HierarchyError
+from simulation import pack, simulate
+from workflow_history import PatchError, apply_patch
+from tenants import DEFAULT_TENANT, QuotaExceeded, Tenant, TenantQuota, TenantStore
+
 app = FastAPI(title="SafeNavi Admin API")
 
 # CORS middleware
@@ -31,6 +43,9 @@ class User(BaseModel):
     role: str = "user"
     status: str = "active"
     created_at: str
+    company_id: Optional[str] = None
+    manager_id: Optional[str] = None
+    department: Optional[str] = None
 
 class WorkflowNode(BaseModel):
     id: str
@@ -52,6 +67,21 @@ class Workflow(BaseModel):
     edges: List[WorkflowEdge]
     created_at: str
     updated_at: str
+    company_id: Optional[str] = None
+    # "active" marks the workflow live expenses are routed through
+    status: str = "draft"
+    version: int = 1
+
+class WorkflowPatch(BaseModel):
+    ops: List[Dict[str, Any]]
+    # Alternative to an If-Match header
+    version: Optional[int] = None
+
+class SimulationRequest(BaseModel):
+    workflow: Workflow
+    baseline_id: Optional[str] = None
+    start: Optional[str] = None
+    end: Optional[str] = None
 
 class Expense(BaseModel):
     id: str
@@ -61,17 +91,34 @@ class Expense(BaseModel):
     description: str
     status: str = "pending"
     created_at: str
+    company_id: Optional[str] = None
+    flags: List[str] = []
 
-# In-memory storage (replace with database in production)
-db = {
-    "users": [],
-    "workflows": [],
-    "expenses": []
-}
+class Receipt(BaseModel):
+    id: str
+    expense_id: str
+    sha256: str
+    filename: Optional[str] = None
+    content_type: Optional[str] = None
+    size: int
+    uploaded_at: str
+    metadata: Dict[str, Any] = {}
+    duplicate_of: List[str] = []
 
-# Initialize with sample data
-if not db["users"]:
-    db["users"].append({
+# Tenant-partitioned storage: each company's users, workflows and expenses
+# live in their own partition (tenants/<company_id>.json) with their own
+# indexes, aggregates, search index and expense archive
+HOT_MONTHS = 3
+SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-keep-it-secure")
+ALGORITHM = "HS256"
+# Without this, requests carrying no token are served from the default tenant
+REQUIRE_TENANT_AUTH = os.getenv("REQUIRE_TENANT_AUTH", "false").lower() == "true"
+
+def seed_default_tenant(tenant: Tenant):
+    if tenant.company_id != DEFAULT_TENANT:
+        return
+    # Initialize with sample data
+    tenant.add("users", {
         "id": str(uuid.uuid4()),
         "name": "Admin User",
         "email": "admin@safenavi.com",
@@ -79,9 +126,7 @@ if not db["users"]:
         "status": "active",
         "created_at": datetime.utcnow().isoformat()
     })
-
-# Initialize with sample expenses for testing
-if not db["expenses"]:
+    # Initialize with sample expenses for testing
     sample_expenses = [
         {"id": str(uuid.uuid4()), "user_id": "user1", "amount": 150.00, "category": "Travel", "description": "Flight tickets", "status": "approved", "created_at": datetime.utcnow().isoformat()},
         {"id": str(uuid.uuid4()), "user_id": "user2", "amount": 45.50, "category": "Meals", "description": "Team lunch", "status": "pending", "created_at": datetime.utcnow().isoformat()},
@@ -89,82 +134,550 @@ if not db["expenses"]:
         {"id": str(uuid.uuid4()), "user_id": "user3", "amount": 75.00, "category": "Travel", "description": "Taxi fare", "status": "pending", "created_at": datetime.utcnow().isoformat()},
         {"id": str(uuid.uuid4()), "user_id": "user2", "amount": 120.00, "category": "Office Supplies", "description": "Stationery", "status": "approved", "created_at": datetime.utcnow().isoformat()},
     ]
-    db["expenses"].extend(sample_expenses)
+    for expense in sample_expenses:
+        tenant.add("expenses", expense)
+
+tenants = TenantStore(
+    root="tenants",
+    archive_root="archive",
+    quota=TenantQuota(
+        requests_per_minute=int(os.getenv("TENANT_REQUESTS_PER_MINUTE", 600)),
+        max_records=int(os.getenv("TENANT_MAX_RECORDS", 100_000)),
+        max_bytes=int(os.getenv("TENANT_MAX_BYTES", 50 * 1024 * 1024)),
+    ),
+    hot_cutoff=lambda: hot_cutoff(HOT_MONTHS),
+    seed=seed_default_tenant,
+)
+# db.json from before tenants existed is split up on first start
+tenants.migrate_legacy("db.json")
+
+# Change feed for live dashboard updates
+changes = ChangeFeed()
+
+# Content-addressed receipt files, shared by all tenants
+receipts = ReceiptStore(
+    root="attachments",
+    max_bytes=int(os.getenv("RECEIPT_MAX_BYTES", 20 * 1024 * 1024)),
+)
 
 # Helper Functions
-def get_db():
-    return db
+def _quota_error(error: QuotaExceeded, status_code: int) -> HTTPException:
+    headers = {"Retry-After": str(max(1, math.ceil(error.retry_after)))} if error.retry_after else None
+    return HTTPException(status_code=status_code, detail=error.detail, headers=headers)
+
+def _admit_tenant(token: Optional[str]) -> Tenant:
+    """Resolve the company from a JWT (None for anonymous) and admit the request."""
+    company_id = DEFAULT_TENANT
+    if token:
+        credentials_exception = HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+        try:
+            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            raise credentials_exception
+        if payload.get("company_id") is None:
+            raise credentials_exception
+        company_id = str(payload["company_id"])
+    elif REQUIRE_TENANT_AUTH:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Not authenticated",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+    try:
+        tenant = tenants.get(company_id)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid company")
+    try:
+        tenant.admit_request()
+    except QuotaExceeded as e:
+        raise _quota_error(e, status.HTTP_429_TOO_MANY_REQUESTS)
+    return tenant
+
+def current_tenant(connection: HTTPConnection) -> Tenant:
+    """Resolve the caller's company from its bearer token and admit the request."""
+    authorization = connection.headers.get("authorization", "")
+    token = authorization[7:] if authorization.lower().startswith("bearer ") else None
+    return _admit_tenant(token)
+
+def stream_tenant(connection: HTTPConnection) -> Tenant:
+    """current_tenant for the change feed; browsers' EventSource and WebSocket
+    can't set an Authorization header, so the token may come as `?token=`."""
+    token = connection.query_params.get("token")
+    return _admit_tenant(token) if token else current_tenant(connection)
 
-def save_db():
-    with open("db.json", "w") as f:
-        json.dump(db, f, indent=2)
+def websocket_tenant(websocket: WebSocket) -> Tenant:
+    """stream_tenant for WebSocket routes, where an HTTPException would only
+    surface as a 500; rejects the handshake with a close code instead."""
+    try:
+        return stream_tenant(websocket)
+    except HTTPException as e:
+        code = status.WS_1013_TRY_AGAIN_LATER if e.status_code == status.HTTP_429_TOO_MANY_REQUESTS else status.WS_1008_POLICY_VIOLATION
+        raise WebSocketException(code=code, reason=str(e.detail))
 
-try:
-    with open("db.json", "r") as f:
-        db.update(json.load(f))
-except FileNotFoundError:
-    save_db()
+def check_storage(tenant: Tenant, extra_bytes: int = 0, new_records: int = 1):
+    try:
+        tenant.check_storage(extra_bytes, new_records)
+    except QuotaExceeded as e:
+        raise _quota_error(e, status.HTTP_403_FORBIDDEN)
 
 # API Endpoints
 @app.get("/api/users", response_model=List[User])
-async def get_users():
-    return db["users"]
+async def get_users(tenant: Tenant = Depends(current_tenant)):
+    return tenant.data["users"]
 
 @app.post("/api/users", status_code=status.HTTP_201_CREATED)
-async def create_user(user: User):
+async def create_user(user: User, tenant: Tenant = Depends(current_tenant)):
+    check_storage(tenant)
     user.id = str(uuid.uuid4())
     user.created_at = datetime.utcnow().isoformat()
-    db["users"].append(user.dict())
-    save_db()
+    user.company_id = tenant.company_id
+    check_manager(tenant, None, user.manager_id)
+    tenant.add("users", user.dict())
+    tenant.save()
+    changes.publish("users", "create", user.dict())
     return user
 
+@app.put("/api/users/{user_id}")
+async def update_user(user_id: str, user: User, tenant: Tenant = Depends(current_tenant)):
+    stored = tenant.get("users", user_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    user.id = user_id
+    user.created_at = stored["created_at"]
+    user.company_id = tenant.company_id
+    if user.manager_id != stored.get("manager_id"):
+        check_manager(tenant, user_id, user.manager_id)
+    previous = tenant.replace("users", user_id, user.dict())
+    tenant.save()
+    changes.publish("users", "update", user.dict(), diff_record(previous, user.dict()))
+    return user
+
+# Org hierarchy, answered from the tenant's precomputed manager chains
+
+def check_manager(tenant: Tenant, user_id: Optional[str], manager_id: Optional[str]):
+    try:
+        tenant.org.check_manager(user_id, manager_id)
+    except HierarchyError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def _org_user(tenant: Tenant, user_id: str) -> Dict[str, Any]:
+    if user_id not in tenant.org:
+        raise HTTPException(status_code=404, detail="User not found")
+    return tenant.get("users", user_id)
+
+@app.get("/api/users/{user_id}/managers", response_model=List[User])
+async def get_manager_chain(user_id: str, tenant: Tenant = Depends(current_tenant)):
+    """The user's manager, their manager, and so on up to the top of the org."""
+    _org_user(tenant, user_id)
+    return [tenant.get("users", m) for m in tenant.org.chain(user_id)]
+
+@app.get("/api/users/{user_id}/reports", response_model=List[User])
+async def get_reports(user_id: str, direct: bool = False, tenant: Tenant = Depends(current_tenant)):
+    _org_user(tenant, user_id)
+    return [tenant.get("users", r) for r in tenant.org.reports(user_id, direct=direct)]
+
+@app.get("/api/users/{user_id}/approver", response_model=Optional[User])
+async def get_approver(
+    user_id: str,
+    role: Optional[str] = None,
+    level: Optional[int] = None,
+    same_department: bool = False,
+    department_head: bool = False,
+    tenant: Tenant = Depends(current_tenant),
+):
+    """Resolve who approves for a user.
+
+    `role` finds the nearest manager with that role (`same_department` limits
+    it to the user's department), `level` the n-th manager up and
+    `department_head` the top of the user's department chain.
+    """
+    user = _org_user(tenant, user_id)
+    if department_head:
+        approver_id = tenant.org.department_head(user_id)
+    elif role is not None:
+        department = user.get("department") if same_department else None
+        if same_department and department is None:
+            approver_id = None
+        else:
+            approver_id = tenant.org.first_with_role(user_id, role, department)
+    else:
+        approver_id = tenant.org.manager(user_id, level or 1)
+    return tenant.get("users", approver_id) if approver_id else None
+
 @app.get("/api/workflows", response_model=List[Workflow])
-async def get_workflows():
-    return db["workflows"]
+async def get_workflows(tenant: Tenant = Depends(current_tenant)):
+    return tenant.data["workflows"]
 
 @app.post("/api/workflows", status_code=status.HTTP_201_CREATED)
-async def create_workflow(workflow: Workflow):
+async def create_workflow(workflow: Workflow, tenant: Tenant = Depends(current_tenant)):
+    check_storage(tenant)
     workflow.id = str(uuid.uuid4())
     workflow.created_at = datetime.utcnow().isoformat()
     workflow.updated_at = workflow.created_at
-    db["workflows"].append(workflow.dict())
-    save_db()
+    workflow.company_id = tenant.company_id
+    workflow.version = 1
+    tenant.add("workflows", workflow.dict())
+    tenant.save()
+    tenant.history.record(workflow.dict())
+    changes.publish("workflows", "create", workflow.dict())
     return workflow
 
+# Workflow versions: every save bumps `version`, which is also the ETag.
+# Writes may pass it back (If-Match header or body) to avoid overwriting
+# someone else's change; each version is kept in the tenant's history log
+
+def _etag(workflow: Dict[str, Any]) -> str:
+    return f'"{workflow.get("version", 1)}"'
+
+def _check_version(stored: Dict[str, Any], if_match: Optional[str], version: Optional[int]):
+    current = stored.get("version", 1)
+    if if_match is not None:
+        expected = [tag.strip().lstrip("W/").strip('"') for tag in if_match.split(",")]
+        if "*" not in expected and str(current) not in expected:
+            raise HTTPException(status_code=412, detail=f"Workflow is at version {current}",
+                                headers={"ETag": _etag(stored)})
+    if version is not None and version != current:
+        raise HTTPException(status_code=412, detail=f"Workflow is at version {current}",
+                            headers={"ETag": _etag(stored)})
+
+def _save_version(tenant: Tenant, workflow_id: str, workflow: Dict[str, Any],
+                  ops: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    if not tenant.history.head(workflow_id):
+        # Saved before versioning: keep the current document as the base version
+        tenant.history.record({**tenant.get("workflows", workflow_id), "version": workflow["version"] - 1})
+    previous = tenant.replace("workflows", workflow_id, workflow)
+    tenant.history.record(workflow, ops)
+    return previous
+
 @app.put("/api/workflows/{workflow_id}")
-async def update_workflow(workflow_id: str, workflow: Workflow):
-    for i, wf in enumerate(db["workflows"]):
-        if wf["id"] == workflow_id:
-            workflow.updated_at = datetime.utcnow().isoformat()
-            db["workflows"][i] = workflow.dict()
-            save_db()
-            return workflow
-    raise HTTPException(status_code=404, detail="Workflow not found")
+async def update_workflow(
+    workflow_id: str,
+    workflow: Workflow,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    tenant: Tenant = Depends(current_tenant),
+):
+    stored = tenant.get("workflows", workflow_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    _check_version(stored, if_match, None)
+    workflow.id = workflow_id
+    workflow.created_at = stored.get("created_at", workflow.created_at)
+    workflow.updated_at = datetime.utcnow().isoformat()
+    workflow.company_id = tenant.company_id
+    workflow.version = stored.get("version", 1) + 1
+    check_storage(tenant, len(json.dumps(workflow.dict())), new_records=0)
+    previous = _save_version(tenant, workflow_id, workflow.dict(), None)
+    tenant.save()
+    changes.publish("workflows", "update", workflow.dict(), diff_record(previous, workflow.dict()))
+    response.headers["ETag"] = _etag(workflow.dict())
+    return workflow
+
+@app.patch("/api/workflows/{workflow_id}", response_model=Workflow)
+async def patch_workflow(
+    workflow_id: str,
+    patch: WorkflowPatch,
+    response: Response,
+    if_match: Optional[str] = Header(None),
+    tenant: Tenant = Depends(current_tenant),
+):
+    """Apply node/edge deltas (see workflow_history.apply_patch) to a workflow.
+
+    Requires the current version, as If-Match or `version` in the body. Only
+    the delta is appended to the history log; the tenant file is not
+    rewritten.
+    """
+    stored = tenant.get("workflows", workflow_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if if_match is None and patch.version is None:
+        raise HTTPException(status_code=428, detail="Send If-Match or version with workflow patches")
+    _check_version(stored, if_match, patch.version)
+    try:
+        patched = apply_patch(stored, patch.ops)
+        patched["version"] = stored.get("version", 1) + 1
+        patched["updated_at"] = datetime.utcnow().isoformat()
+        workflow = Workflow(**patched)
+    except PatchError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Patched workflow is invalid: {e}")
+    # Usually only the ops are logged, but every SNAPSHOT_EVERY-th version
+    # carries the whole document
+    check_storage(tenant, len(json.dumps(workflow.dict())), new_records=0)
+    previous = _save_version(tenant, workflow_id, workflow.dict(), patch.ops)
+    changes.publish("workflows", "update", workflow.dict(), diff_record(previous, workflow.dict()))
+    response.headers["ETag"] = _etag(workflow.dict())
+    return workflow
+
+@app.get("/api/workflows/{workflow_id}/versions")
+async def get_workflow_versions(workflow_id: str, tenant: Tenant = Depends(current_tenant)):
+    if tenant.get("workflows", workflow_id) is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    return tenant.history.versions(workflow_id)
+
+@app.get("/api/workflows/{workflow_id}/versions/{version}", response_model=Workflow)
+async def get_workflow_version(workflow_id: str, version: int, response: Response,
+                               tenant: Tenant = Depends(current_tenant)):
+    stored = tenant.get("workflows", workflow_id)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="Workflow not found")
+    if version == stored.get("version", 1):
+        workflow = stored
+    else:
+        workflow = tenant.history.version(workflow_id, version)
+        if workflow is None:
+            raise HTTPException(status_code=404, detail="Version not found")
+    response.headers["ETag"] = _etag(workflow)
+    return workflow
+
+@app.post("/api/workflows/simulate")
+async def simulate_workflow(request: SimulationRequest, tenant: Tenant = Depends(current_tenant)):
+    """Replay historical expenses through a candidate workflow and diff it against a baseline."""
+    try:
+        end_ts = to_timestamp(request.end) if request.end else datetime.utcnow().timestamp()
+        start_ts = to_timestamp(request.start) if request.start else end_ts - 365 * 86400
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO dates")
+    if end_ts <= start_ts:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    if request.baseline_id:
+        baseline = tenant.get("workflows", request.baseline_id)
+        if baseline is None:
+            raise HTTPException(status_code=404, detail="Baseline workflow not found")
+    else:
+        # Default to the live workflow; without one only the candidate is reported
+        baseline = next((w for w in tenant.data["workflows"] if w.get("status") == "active"), None)
+
+    days = math.ceil((end_ts - start_ts) / 86400)
+    hot = list(tenant.data["expenses"])
+    archive = tenant.archive if tenant.has_archive() else None
+
+    def run():
+        # Parsing timestamps and decoding archived records is as slow as the
+        # replay itself, so it stays off the event loop too
+        rows = []
+        for expense in hot:
+            ts = to_timestamp(expense["created_at"])
+            if start_ts <= ts < end_ts:
+                rows.append(pack(expense, ts))
+        if archive is not None:
+            rows.extend(pack(e, to_timestamp(e["created_at"])) for e in archive.records(start_ts, end_ts))
+        rows.sort(key=lambda row: row[0])
+        return simulate(request.workflow.dict(), baseline, rows, start_ts, days)
+
+    result = await asyncio.get_running_loop().run_in_executor(None, run)
+    return {
+        "start": datetime.utcfromtimestamp(start_ts).isoformat(),
+        "end": datetime.utcfromtimestamp(end_ts).isoformat(),
+        "baseline_id": baseline["id"] if baseline else None,
+        **result,
+    }
 
 @app.get("/api/expenses", response_model=List[Expense])
-async def get_expenses():
-    return db["expenses"]
+async def get_expenses(
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    category: Optional[str] = None,
+    tenant: Tenant = Depends(current_tenant),
+):
+    # Without a range only the hot (recent) expenses are returned
+    if start is None and end is None:
+        expenses = tenant.data["expenses"]
+        return [e for e in expenses if e["category"] == category] if category else expenses
+    try:
+        start_ts = to_timestamp(start) if start else None
+        end_ts = to_timestamp(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO dates")
+    in_range = lambda ts: (start_ts is None or ts >= start_ts) and (end_ts is None or ts < end_ts)
+    hot = [
+        e for e in tenant.data["expenses"]
+        if in_range(to_timestamp(e["created_at"])) and (category is None or e["category"] == category)
+    ]
+    cold = []
+    if tenant.has_archive() and (start_ts is None or start < hot_cutoff(HOT_MONTHS)):
+        cold = list(tenant.archive.records(start_ts, end_ts, category))
+    return cold + hot
 
 @app.post("/api/expenses/analyze")
-async def analyze_expenses():
+async def analyze_expenses(tenant: Tenant = Depends(current_tenant)):
     # Simple analysis - in a real app, you'd use ML here
-    expenses = db["expenses"]
-    total = sum(e["amount"] for e in expenses)
-    by_category = {}
-    for e in expenses:
-        by_category[e["category"]] = by_category.get(e["category"], 0) + e["amount"]
+    # Answered from the tenant's running totals and archive summaries
+    summary = tenant.expense_summary()
+    count = summary["count"]
+    total = summary["total"]
+    by_category = summary["by_category"]
     
     return {
         "total_expenses": total,
         "by_category": by_category,
-        "average_per_user": total / len(expenses) if expenses else 0,
+        "average_per_user": total / count if count else 0,
         "insights": [
             f"Top spending category: {max(by_category.items(), key=lambda x: x[1])[0] if by_category else 'N/A'}",
             f"Total expenses: ${total:.2f}",
-            f"Average per user: ${(total / len(expenses)) if expenses else 0:.2f}"
+            f"Average per user: ${(total / count) if count else 0:.2f}"
         ]
     }
 
+@app.post("/api/expenses/{expense_id}/receipts", response_model=Receipt, status_code=status.HTTP_201_CREATED)
+async def upload_receipt(expense_id: str, request: Request, tenant: Tenant = Depends(current_tenant)):
+    expense = tenant.get("expenses", expense_id)
+    if expense is None:
+        raise HTTPException(status_code=404, detail="Expense not found")
+    check_storage(tenant)
+    try:
+        upload = await receipts.receive(request, quota_bytes=tenant.quota.max_bytes - tenant.used_bytes())
+    except UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    if upload["sha256"] not in tenant.receipts_by_hash:
+        # New bytes for this company count against its storage quota
+        try:
+            tenant.check_storage(upload["size"])
+        except QuotaExceeded as e:
+            if upload["stored"]:
+                receipts.discard(upload["sha256"])
+            raise _quota_error(e, status.HTTP_403_FORBIDDEN)
+
+    # Same bytes already submitted within this company: duplicate-receipt signal
+    earlier = [r for r in tenant.receipts_by_hash.get(upload["sha256"], []) if r["expense_id"] != expense_id]
+    metadata = earlier[0]["metadata"] if earlier else await receipts.describe(upload["sha256"])
+    receipt = Receipt(
+        id=str(uuid.uuid4()),
+        expense_id=expense_id,
+        sha256=upload["sha256"],
+        filename=upload["filename"],
+        content_type=upload["content_type"],
+        size=upload["size"],
+        uploaded_at=datetime.utcnow().isoformat(),
+        metadata=metadata,
+        duplicate_of=sorted({r["expense_id"] for r in earlier}),
+    )
+    tenant.add("receipts", receipt.dict())
+    if earlier and "duplicate_receipt" not in expense.get("flags", []):
+        updated = {**expense, "flags": expense.get("flags", []) + ["duplicate_receipt"]}
+        previous = tenant.replace("expenses", expense_id, updated)
+        changes.publish("expenses", "update", updated, diff_record(previous, updated))
+    tenant.save()
+    changes.publish("receipts", "create", tenant.get("receipts", receipt.id))
+    return receipt
+
+@app.get("/api/expenses/{expense_id}/receipts", response_model=List[Receipt])
+async def get_receipts(expense_id: str, tenant: Tenant = Depends(current_tenant)):
+    return [r for r in tenant.data["receipts"] if r["expense_id"] == expense_id]
+
+@app.get("/api/receipts/{receipt_id}")
+async def download_receipt(receipt_id: str, request: Request, tenant: Tenant = Depends(current_tenant)):
+    receipt = tenant.get("receipts", receipt_id)
+    if receipt is None:
+        raise HTTPException(status_code=404, detail="Receipt not found")
+    return RangeFileResponse(
+        receipts.blob_path(receipt["sha256"]),
+        range_header=request.headers.get("range"),
+        media_type=receipt["content_type"],
+        etag=receipt["sha256"],
+        filename=receipt["filename"],
+    )
+
+@app.get("/api/receipts/{receipt_id}/thumbnail")
+async def receipt_thumbnail(receipt_id: str, request: Request, tenant: Tenant = Depends(current_tenant)):
+    receipt = tenant.get("receipts", receipt_id)
+    if receipt is None or not receipt["metadata"].get("thumbnail"):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    return RangeFileResponse(
+        receipts.thumbnail_path(receipt["sha256"]),
+        range_header=request.headers.get("range"),
+        media_type="image/jpeg",
+        etag=receipt["sha256"],
+    )
+
+@app.get("/api/search")
+async def search(
+    q: str,
+    collection: Optional[str] = None,
+    limit: int = 20,
+    fuzzy: bool = True,
+    tenant: Tenant = Depends(current_tenant),
+):
+    if limit < 1 or limit > 100:
+        raise HTTPException(status_code=400, detail="limit must be between 1 and 100")
+    collections = collection.split(",") if collection else None
+    return {"query": q, "results": tenant.search_records(q, collections, limit, fuzzy=fuzzy)}
+
+def _change_topics(collection: Optional[str], company: Optional[str], status: Optional[str]):
+    split = lambda v: v.split(",") if v else None
+    return {"collection": split(collection), "company": split(company), "status": split(status)}
+
+@app.get("/api/changes")
+async def stream_changes(
+    request: Request,
+    collection: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    tenant: Tenant = Depends(stream_tenant),
+):
+    # EventSource sends Last-Event-ID on its own reconnects; it is newer than
+    # a `since` baked into the URL when the stream was first opened
+    since = request.headers.get("last-event-id") or since
+    sub = changes.subscribe(_change_topics(collection, tenant.company_id, status), since)
+    start = since if since and not sub.needs_resync else changes.cursor()
+
+    async def event_stream():
+        try:
+            yield f"retry: 3000\nid: {start}\n\n"
+            while not await request.is_disconnected():
+                batch = await sub.next_batch(timeout=15)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+                for event in batch:
+                    yield f"id: {event['cursor']}\nevent: {event['op']}\ndata: {json.dumps(event)}\n\n"
+        finally:
+            changes.unsubscribe(sub)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/api/changes/ws")
+async def websocket_changes(
+    websocket: WebSocket,
+    collection: Optional[str] = None,
+    status: Optional[str] = None,
+    since: Optional[str] = None,
+    tenant: Tenant = Depends(websocket_tenant),
+):
+    await websocket.accept()
+    sub = changes.subscribe(_change_topics(collection, tenant.company_id, status), since)
+
+    async def wait_disconnect():
+        # Clients never send anything; receive() only returns once they go away
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+
+    watcher = asyncio.create_task(wait_disconnect())
+    try:
+        await websocket.send_json({"op": "hello", "seq": changes.last_seq, "cursor": changes.cursor()})
+        while True:
+            next_batch = asyncio.create_task(sub.next_batch(timeout=15))
+            done, _ = await asyncio.wait({next_batch, watcher}, return_when=asyncio.FIRST_COMPLETED)
+            if watcher in done:
+                next_batch.cancel()
+                break
+            await websocket.send_json(next_batch.result())
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        changes.unsubscribe(sub)
+
 # Serve the admin panel
 @app.get("/admin", response_class=HTMLResponse)
 async def serve_admin():
@@ -0,0 +1,173 @@
+from collections import deque
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+
+class HierarchyError(ValueError):
+    pass
+
+
+class OrgHierarchy:
+    """Manager chains for one company, precomputed for approval routing.
+
+    Every user keeps an ancestor array (manager first, top of the org last)
+    and a map from role to the nearest manager holding it, so manager chains
+    and "first approver with role X" are answered without walking the user
+    list. When a user's manager or role changes only that user's subtree is
+    recomputed. Managers that would form a cycle are rejected; cycles already
+    present in stored data are broken by treating one member as a root.
+    """
+
+    def __init__(self, users: Iterable[Dict[str, Any]] = ()):
+        self.users: Dict[str, Dict[str, Any]] = {}
+        self.parent: Dict[str, Optional[str]] = {}
+        self.children: Dict[str, Set[str]] = {}
+        self.ancestors: Dict[str, List[str]] = {}
+        self.first_by_role: Dict[str, Dict[str, str]] = {}
+        self.rebuild(users)
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self.users
+
+    def rebuild(self, users: Iterable[Dict[str, Any]]):
+        self.users = {user["id"]: user for user in users}
+        self.parent, self.children, self.ancestors, self.first_by_role = {}, {}, {}, {}
+        for user_id in self.users:
+            self.children[user_id] = set()
+        for user_id, user in self.users.items():
+            manager_id = user.get("manager_id")
+            if manager_id in self.users and manager_id != user_id:
+                self.parent[user_id] = manager_id
+                self.children[manager_id].add(user_id)
+            else:
+                self.parent[user_id] = None
+        for user_id in self.users:
+            if self.parent[user_id] is None:
+                self._refresh(user_id)
+        # Whatever is still unplaced sits on a stored cycle; cut it at one member
+        for user_id in self.users:
+            if user_id not in self.ancestors:
+                self._detach(user_id)
+                self._refresh(user_id)
+
+    # Updates
+
+    def check_manager(self, user_id: Optional[str], manager_id: Optional[str]):
+        """Raise HierarchyError if `manager_id` can't become `user_id`'s manager."""
+        if manager_id is None:
+            return
+        if manager_id not in self.users:
+            raise HierarchyError(f"Manager {manager_id} not found")
+        if manager_id == user_id or (user_id is not None and user_id in self.ancestors[manager_id]):
+            raise HierarchyError("Manager assignment would create a reporting cycle")
+
+    def add(self, user: Dict[str, Any]):
+        user_id = user["id"]
+        self.check_manager(None, user.get("manager_id"))
+        self.users[user_id] = user
+        self.children[user_id] = set()
+        self.parent[user_id] = None
+        self._attach(user_id, user.get("manager_id"))
+        self._refresh(user_id)
+
+    def update(self, user: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+        """Apply a changed user record; recomputes the subtree if manager or role changed."""
+        user_id = user["id"]
+        if user_id not in self.users:
+            self.add(user)
+            return
+        previous = previous or self.users[user_id]
+        manager_id = user.get("manager_id")
+        moved = manager_id != previous.get("manager_id")
+        if moved:
+            self.check_manager(user_id, manager_id)
+            self._detach(user_id)
+            self._attach(user_id, manager_id)
+        self.users[user_id] = user
+        if moved or user.get("role") != previous.get("role"):
+            self._refresh(user_id)
+
+    def remove(self, user_id: str):
+        """Drop a user; their reports become roots."""
+        self._detach(user_id)
+        for child in list(self.children.pop(user_id, ())):
+            self.parent[child] = None
+            self._refresh(child)
+        for table in (self.users, self.parent, self.ancestors, self.first_by_role):
+            table.pop(user_id, None)
+
+    def _attach(self, user_id: str, manager_id: Optional[str]):
+        if manager_id in self.users:
+            self.parent[user_id] = manager_id
+            self.children[manager_id].add(user_id)
+
+    def _detach(self, user_id: str):
+        manager_id = self.parent.get(user_id)
+        if manager_id is not None:
+            self.children[manager_id].discard(user_id)
+        self.parent[user_id] = None
+
+    def _refresh(self, user_id: str):
+        # Parents are always refreshed before their reports, so each user's
+        # arrays are derived from the manager's in O(depth)
+        queue = deque([user_id])
+        while queue:
+            current = queue.popleft()
+            manager_id = self.parent[current]
+            if manager_id is None:
+                self.ancestors[current] = []
+                self.first_by_role[current] = {}
+            else:
+                self.ancestors[current] = [manager_id] + self.ancestors[manager_id]
+                roles = dict(self.first_by_role[manager_id])
+                roles[self.users[manager_id].get("role")] = manager_id
+                self.first_by_role[current] = roles
+            queue.extend(self.children[current])
+
+    # Queries
+
+    def chain(self, user_id: str) -> List[str]:
+        """Manager, manager's manager, ... up to the top of the org."""
+        return list(self.ancestors[user_id])
+
+    def manager(self, user_id: str, level: int = 1) -> Optional[str]:
+        chain = self.ancestors[user_id]
+        return chain[level - 1] if 0 < level <= len(chain) else None
+
+    def reports(self, user_id: str, direct: bool = False) -> List[str]:
+        """Users below `user_id`, breadth first."""
+        if direct:
+            return sorted(self.children[user_id])
+        found, queue = [], deque(sorted(self.children[user_id]))
+        while queue:
+            current = queue.popleft()
+            found.append(current)
+            queue.extend(sorted(self.children[current]))
+        return found
+
+    def is_ancestor(self, ancestor_id: str, user_id: str) -> bool:
+        return ancestor_id in self.ancestors[user_id]
+
+    def first_with_role(self, user_id: str, role: str, department: Optional[str] = None) -> Optional[str]:
+        """Nearest manager of `user_id` with `role`, optionally within `department`."""
+        if department is None:
+            return self.first_by_role[user_id].get(role)
+        for ancestor_id in self.ancestors[user_id]:
+            candidate = self.users[ancestor_id]
+            if candidate.get("role") == role and candidate.get("department") == department:
+                return ancestor_id
+        return None
+
+    def department_head(self, user_id: str) -> Optional[str]:
+        """Topmost manager in the unbroken chain of `user_id`'s own department."""
+        department = self.users[user_id].get("department")
+        if department is None:
+            return None
+        head = None
+        for ancestor_id in self.ancestors[user_id]:
+            if self.users[ancestor_id].get("department") != department:
+                break
+            head = ancestor_id
+        return head
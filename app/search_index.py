@@ -0,0 +1,455 @@
+import bisect
+import heapq
+import json
+import math
+import os
+import re
+import threading
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# Text fields indexed for each collection
+SEARCH_FIELDS = {
+    "expenses": ("description", "category"),
+    "users": ("name", "email"),
+    "workflows": ("name",),
+}
+
+TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Score multipliers for terms that only matched by prefix or by edit distance
+PREFIX_WEIGHT = 0.7
+FUZZY_WEIGHT = 0.5
+
+# The ops log is folded into a fresh snapshot once it holds this many ops,
+# or a quarter of the document count if that is larger
+COMPACT_MIN_OPS = 1000
+COMPACT_RATIO = 0.25
+
+
+def tokenize(text: str) -> List[str]:
+    return TOKEN_RE.findall(str(text).lower())
+
+
+def _deletes(term: str) -> Set[str]:
+    """All variants of `term` with one character removed."""
+    return {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    if len(a) == len(b):
+        return a[i + 1:] == b[i + 1:]
+    return a[i:] == b[i + 1:]
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _compaction_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=1)
+    return _pool
+
+
+def _fold_log(path: str, consumed: int) -> str:
+    """Fold the first `consumed` bytes of the log into a new snapshot file. Runs in a worker process."""
+    folded = SearchIndex()
+    folded._load_snapshot(path)
+    folded._replay(path + ".log", consumed)
+    tmp = path + ".compact"
+    with open(tmp, "w") as f:
+        json.dump({"docs": folded.docs, "postings": folded.postings}, f)
+    return tmp
+
+
+class SearchIndex:
+    """In-memory inverted index with BM25 ranking.
+
+    Documents are keyed as "<collection>:<id>". Besides the postings, the index
+    keeps a sorted vocabulary for prefix lookups and a single-deletion table
+    (SymSpell style) so fuzzy matches are found without scanning every term.
+
+    Each term's postings are also grouped by (tf, document length). Every
+    document in such a group scores the same for that term, so queries walk
+    the groups best-first and stop once the top results can no longer change
+    (Fagin's threshold algorithm) instead of scoring every matching document.
+
+    Documents for archived records are frozen: they keep their postings and
+    length but not a copy of their text, and carry the record's created_at
+    timestamp instead so callers can read the text back from the archive for
+    the few results they return.
+
+    On disk the index is a snapshot plus an append-only log of document adds,
+    removes and freezes (<path>.log). `flush` only appends the changes made since the
+    last flush; the log is folded into a new snapshot in a worker process,
+    working from the files rather than the live index.
+    """
+
+    def __init__(self):
+        self._pending: List[Dict[str, Any]] = []
+        self._log_ops = 0
+        self._generation = 0  # bumped by save() so a running compaction is discarded
+        self._log_lock = threading.Lock()
+        self._compacting = False
+        self._clear()
+
+    def _clear(self):
+        self.postings: Dict[str, Dict[str, int]] = {}
+        self.impacts: Dict[str, Dict[Tuple[int, int], Set[str]]] = {}
+        self.docs: Dict[str, Dict[str, Any]] = {}
+        self.total_length = 0
+        self.frozen = 0
+        self.vocabulary: List[str] = []
+        self._vocabulary_sorted = True
+        self.deletes: Dict[str, Set[str]] = defaultdict(set)
+
+    def __len__(self):
+        return len(self.docs)
+
+    # Indexing
+
+    def add(self, collection: str, record: Dict[str, Any]):
+        key = f"{collection}:{record['id']}"
+        if key in self.docs:
+            self.remove(collection, record["id"])
+        fields = {f: record.get(f) or "" for f in SEARCH_FIELDS.get(collection, ())}
+        tokens = [t for value in fields.values() for t in tokenize(value)]
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        for term, tf in counts.items():
+            if term not in self.postings:
+                self._add_term(term)
+            self.postings[term][key] = tf
+            self.impacts[term].setdefault((tf, len(tokens)), set()).add(key)
+        self.docs[key] = {"collection": collection, "id": record["id"],
+                          "length": len(tokens), "terms": list(counts), "fields": fields}
+        self.total_length += len(tokens)
+        self._pending.append({"op": "add", "collection": collection, "id": record["id"], "fields": fields})
+
+    def remove(self, collection: str, record_id: str):
+        key = f"{collection}:{record_id}"
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        self._pending.append({"op": "remove", "collection": collection, "id": record_id})
+        self.total_length -= doc["length"]
+        self.frozen -= "ts" in doc
+        for term in doc["terms"]:
+            posting = self.postings.get(term)
+            if posting is None:
+                continue
+            tf = posting.pop(key, None)
+            group = self.impacts[term].get((tf, doc["length"]))
+            if group is not None:
+                group.discard(key)
+                if not group:
+                    del self.impacts[term][(tf, doc["length"])]
+            if not posting:
+                self._drop_term(term)
+
+    def update(self, collection: str, record: Dict[str, Any]):
+        self.add(collection, record)
+
+    def freeze(self, collection: str, record_id: str, ts: float):
+        """Drop the stored text of a document whose record moved to cold storage."""
+        doc = self.docs.get(f"{collection}:{record_id}")
+        if doc is None or "ts" in doc:
+            return
+        del doc["fields"]
+        doc["ts"] = ts
+        self.frozen += 1
+        self._pending.append({"op": "freeze", "collection": collection, "id": record_id, "ts": ts})
+
+    def rebuild(self, db: Dict[str, List[Dict[str, Any]]],
+                cold: Optional[Iterable[Tuple[str, Dict[str, Any], float]]] = None):
+        """Re-index the records in `db`; callers save() afterwards.
+
+        Frozen documents are kept as they are unless `cold` is given, in
+        which case they are replaced by its (collection, record, ts) entries.
+        """
+        if cold is None:
+            for doc in list(self.docs.values()):
+                if "ts" not in doc:
+                    self.remove(doc["collection"], doc["id"])
+        else:
+            self._clear()
+            for collection, record, ts in cold:
+                self.add(collection, record)
+                self.freeze(collection, record["id"], ts)
+                # Nothing is flushed before the save, so don't hold the text
+                self._pending = []
+        for collection in SEARCH_FIELDS:
+            for record in db.get(collection, []):
+                self.add(collection, record)
+        self._pending = []
+
+    def _add_term(self, term: str):
+        self.postings[term] = {}
+        self.impacts[term] = {}
+        # Sorted lazily: timsort on an almost-sorted list is linear, and bulk
+        # loads only pay for one sort
+        self.vocabulary.append(term)
+        self._vocabulary_sorted = False
+        for variant in _deletes(term):
+            self.deletes[variant].add(term)
+
+    def _drop_term(self, term: str):
+        del self.postings[term]
+        del self.impacts[term]
+        self._sort_vocabulary()
+        i = bisect.bisect_left(self.vocabulary, term)
+        if i < len(self.vocabulary) and self.vocabulary[i] == term:
+            self.vocabulary.pop(i)
+        for variant in _deletes(term):
+            terms = self.deletes.get(variant)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del self.deletes[variant]
+
+    def _sort_vocabulary(self):
+        if not self._vocabulary_sorted:
+            self.vocabulary.sort()
+            self._vocabulary_sorted = True
+
+    # Querying
+
+    def _prefix_terms(self, prefix: str, limit: int = 50) -> List[str]:
+        self._sort_vocabulary()
+        i = bisect.bisect_left(self.vocabulary, prefix)
+        found = []
+        while i < len(self.vocabulary) and self.vocabulary[i].startswith(prefix) and len(found) < limit:
+            found.append(self.vocabulary[i])
+            i += 1
+        return found
+
+    def _fuzzy_terms(self, token: str) -> Set[str]:
+        candidates = set(self.deletes.get(token, ()))
+        for variant in _deletes(token) | {token}:
+            if variant in self.postings:
+                candidates.add(variant)
+            candidates.update(self.deletes.get(variant, ()))
+        return {t for t in candidates if _within_one_edit(token, t)}
+
+    def expand(self, token: str, prefix: bool = True, fuzzy: bool = True) -> Dict[str, float]:
+        """Map a query token to the index terms it matches and their weights."""
+        terms: Dict[str, float] = {}
+        if fuzzy and len(token) > 3:
+            for term in self._fuzzy_terms(token):
+                terms[term] = FUZZY_WEIGHT
+        if prefix and len(token) > 1:
+            for term in self._prefix_terms(token):
+                terms[term] = max(terms.get(term, 0), PREFIX_WEIGHT)
+        if token in self.postings:
+            terms[token] = 1.0
+        return terms
+
+    def search(self, query: str, collections: Optional[Iterable[str]] = None, limit: int = 20,
+               prefix: bool = True, fuzzy: bool = True) -> List[Dict[str, Any]]:
+        if not self.docs or limit <= 0:
+            return []
+        allowed = set(collections) if collections else None
+        n = len(self.docs)
+        avg_length = self.total_length / n or 1
+
+        def bm25(tf: int, length: int) -> float:
+            return tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / avg_length))
+
+        # One list per matched index term: (term, weight * idf, groups best-first)
+        lists = []
+        for token in set(tokenize(query)):
+            for term, weight in self.expand(token, prefix, fuzzy).items():
+                df = len(self.postings[term])
+                boost = weight * math.log(1 + (n - df + 0.5) / (df + 0.5))
+                groups = sorted(((boost * bm25(tf, length), keys)
+                                 for (tf, length), keys in self.impacts[term].items()),
+                                key=lambda group: group[0], reverse=True)
+                lists.append((term, boost, groups))
+
+        def full_score(key: str) -> float:
+            length = self.docs[key]["length"]
+            score = 0.0
+            for term, boost, _ in lists:
+                tf = self.postings[term].get(key)
+                if tf:
+                    score += boost * bm25(tf, length)
+            return score
+
+        top: List[Tuple[float, str]] = []
+        seen: Set[str] = set()
+        positions = [0] * len(lists)
+        while True:
+            heads = [groups[pos][0] if pos < len(groups) else 0.0
+                     for pos, (_, _, groups) in zip(positions, lists)]
+            threshold = sum(heads)
+            if not threshold or (len(top) >= limit and top[0][0] >= threshold):
+                break
+            i = max(range(len(lists)), key=heads.__getitem__)
+            _, keys = lists[i][2][positions[i]]
+            positions[i] += 1
+            for key in keys:
+                if key in seen:
+                    continue
+                seen.add(key)
+                if allowed and self.docs[key]["collection"] not in allowed:
+                    continue
+                entry = (full_score(key), key)
+                if len(top) < limit:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+                if len(top) >= limit and top[0][0] >= threshold:
+                    # Nothing left in this group or after it can rank higher
+                    break
+
+        results = []
+        for score, key in sorted(top, reverse=True):
+            doc = self.docs[key]
+            result = {"collection": doc["collection"], "id": doc["id"], "score": round(score, 4),
+                      "fields": doc.get("fields")}
+            if "ts" in doc:
+                result["ts"] = doc["ts"]
+            results.append(result)
+        return results
+
+    # Persistence
+
+    def save(self, path: str):
+        """Write a full snapshot and start a new, empty log."""
+        with self._log_lock:
+            self._write_snapshot(path, self.docs, self.postings)
+            if os.path.exists(path + ".log"):
+                os.remove(path + ".log")
+            self._log_ops = 0
+            self._generation += 1
+            self._pending = []
+
+    def flush(self, path: str):
+        """Append the changes made since the last save or flush to the log."""
+        if not self._pending:
+            return
+        if not os.path.exists(path):
+            self.save(path)
+            return
+        pending, self._pending = self._pending, []
+        with self._log_lock:
+            with open(path + ".log", "a") as f:
+                f.writelines(json.dumps(op, separators=(",", ":")) + "\n" for op in pending)
+            self._log_ops += len(pending)
+        threshold = max(COMPACT_MIN_OPS, int(len(self.docs) * COMPACT_RATIO))
+        if self._log_ops >= threshold and not self._compacting:
+            self._start_compaction(path)
+
+    def _start_compaction(self, path: str):
+        with self._log_lock:
+            log_path = path + ".log"
+            consumed = os.path.getsize(log_path) if os.path.exists(log_path) else 0
+            consumed_ops, generation = self._log_ops, self._generation
+        self._compacting = True
+        future = _compaction_pool().submit(_fold_log, path, consumed)
+        future.add_done_callback(lambda f: self._finish_compaction(path, f, consumed, consumed_ops, generation))
+
+    def _finish_compaction(self, path: str, future, consumed: int, consumed_ops: int, generation: int):
+        try:
+            tmp = future.result()
+            with self._log_lock:
+                if generation != self._generation:
+                    os.remove(tmp)
+                    return
+                # Ops appended while the snapshot was built stay in the log.
+                # Replaying an op twice is harmless, so a crash between the
+                # two replaces only costs a longer replay
+                log_path = path + ".log"
+                os.replace(tmp, path)
+                with open(log_path, "rb") as f:
+                    f.seek(consumed)
+                    tail = f.read()
+                with open(log_path + ".tmp", "wb") as f:
+                    f.write(tail)
+                os.replace(log_path + ".tmp", log_path)
+                self._log_ops -= consumed_ops
+        except Exception:
+            # The log is still complete; the next flush retries
+            pass
+        finally:
+            self._compacting = False
+
+    @staticmethod
+    def _write_snapshot(path: str, docs, postings):
+        with open(path + ".tmp", "w") as f:
+            json.dump({"docs": docs, "postings": postings}, f)
+        os.replace(path + ".tmp", path)
+
+    def load(self, path: str) -> bool:
+        """Load a saved index and replay its log. Returns False if there is nothing to load."""
+        if not self._load_snapshot(path):
+            return False
+        self._log_ops = self._replay(path + ".log")
+        self._pending = []
+        return True
+
+    def _load_snapshot(self, path: str) -> bool:
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return False
+        self._clear()
+        self.docs = data["docs"]
+        self.postings = data["postings"]
+        self.total_length = sum(doc["length"] for doc in self.docs.values())
+        self.frozen = sum("ts" in doc for doc in self.docs.values())
+        self.vocabulary = sorted(self.postings)
+        for term, posting in self.postings.items():
+            groups = self.impacts[term] = {}
+            for key, tf in posting.items():
+                groups.setdefault((tf, self.docs[key]["length"]), set()).add(key)
+        for term in self.vocabulary:
+            for variant in _deletes(term):
+                self.deletes[variant].add(term)
+        return True
+
+    def _replay(self, log_path: str, limit: Optional[int] = None) -> int:
+        if not os.path.exists(log_path):
+            return 0
+        with open(log_path, "rb") as f:
+            data = f.read() if limit is None else f.read(limit)
+        count, offset = 0, 0
+        while offset < len(data):
+            end = data.find(b"\n", offset)
+            if end == -1:
+                break
+            try:
+                op = json.loads(data[offset:end])
+            except ValueError:
+                break
+            if op["op"] == "add":
+                self.add(op["collection"], {"id": op["id"], **op["fields"]})
+            elif op["op"] == "freeze":
+                self.freeze(op["collection"], op["id"], op["ts"])
+            else:
+                self.remove(op["collection"], op["id"])
+            count += 1
+            offset = end + 1
+        if limit is None and offset < len(data):
+            # Torn last line from a crash mid-append; drop it so new ops
+            # don't get glued onto it
+            with open(log_path, "r+b") as f:
+                f.truncate(offset)
+        return count
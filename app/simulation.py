@@ -0,0 +1,263 @@
+import math
+import os
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Expense fields conditions may test, in the order rows are packed for workers
+FIELDS = ("amount", "category", "description", "user_id")
+FIELD_INDEX = {name: i + 1 for i, name in enumerate(FIELDS)}  # slot 0 is created_at
+
+DAY = 86400
+DEFAULT_TIMEOUT_HOURS = 24
+TRUE_LABELS = {"true", "yes", "y", "1"}
+FALSE_LABELS = {"false", "no", "n", "0", "else"}
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def pack(expense: Dict[str, Any], timestamp: float) -> Tuple:
+    """Reduce an expense to the tuple shipped to worker processes."""
+    return (timestamp,) + tuple(expense.get(name) for name in FIELDS)
+
+
+class CompiledWorkflow:
+    """A workflow graph resolved into lookups the replay loop can walk quickly.
+
+    Node semantics follow the workflow builder: `condition` nodes test an
+    expense field (`data` or the builder's `condition` dict with type/field,
+    operator and value) and branch on edges labelled true/false; `approver`
+    nodes hold an expense for `timeout_hours`; `reject` ends as rejected and
+    `end` (or a node without outgoing edges) ends the walk. Workflows saved
+    without edges are walked in node order, with a false condition jumping to
+    `if_false` ("end" by default).
+    """
+
+    def __init__(self, workflow: Dict[str, Any]):
+        self.nodes = {node["id"]: node for node in workflow.get("nodes", [])}
+        order = [node["id"] for node in workflow.get("nodes", [])]
+        self.next: Dict[str, Optional[str]] = {}
+        self.branches: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        edges = workflow.get("edges", [])
+        if edges:
+            outgoing: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+            for edge in edges:
+                outgoing[edge["source"]].append(edge)
+            targets = {edge["target"] for edge in edges}
+            starts = [n for n in order if self.nodes[n].get("type") == "start"] or \
+                     [n for n in order if n not in targets] or order[:1]
+            self.start = starts[0] if starts else None
+            for node_id in order:
+                out = outgoing.get(node_id, [])
+                when_true = next((e["target"] for e in out if e.get("label", "").lower() in TRUE_LABELS), None)
+                when_false = next((e["target"] for e in out if e.get("label", "").lower() in FALSE_LABELS), None)
+                unlabelled = [e["target"] for e in out if e.get("label", "").lower() not in TRUE_LABELS | FALSE_LABELS]
+                self.next[node_id] = unlabelled[0] if unlabelled else when_true
+                self.branches[node_id] = (when_true or (unlabelled[0] if unlabelled else None),
+                                          when_false or (unlabelled[1] if len(unlabelled) > 1 else None))
+        else:
+            self.start = order[0] if order else None
+            for i, node_id in enumerate(order):
+                following = order[i + 1] if i + 1 < len(order) else None
+                settings = self._settings(self.nodes[node_id])
+                self.next[node_id] = following
+                self.branches[node_id] = (self._jump(settings.get("if_true", "next"), following),
+                                          self._jump(settings.get("if_false", "end"), following))
+        self.conditions = {
+            node_id: self._condition(node) for node_id, node in self.nodes.items()
+            if node.get("type") == "condition"
+        }
+        self.timeouts = {
+            node_id: float(self._settings(node).get("timeout_hours", DEFAULT_TIMEOUT_HOURS)) * 3600
+            for node_id, node in self.nodes.items() if node.get("type") == "approver"
+        }
+
+    @staticmethod
+    def _settings(node: Dict[str, Any]) -> Dict[str, Any]:
+        return {**node, **(node.get("data") or {})}
+
+    def _jump(self, target: str, following: Optional[str]) -> Optional[str]:
+        if target == "next":
+            return following
+        if target == "end":
+            return None
+        return target if target in self.nodes else None
+
+    def _condition(self, node: Dict[str, Any]):
+        settings = self._settings(node)
+        rule = settings.get("condition") if isinstance(settings.get("condition"), dict) else settings
+        field = rule.get("field") or rule.get("type") or "amount"
+        operator = rule.get("operator", "greater_than")
+        value = rule.get("value")
+        index = FIELD_INDEX.get(field)
+        if index is None:
+            return lambda row: False
+        if field == "amount":
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return lambda row: False
+        elif value is not None:
+            value = str(value).lower()
+        if operator == "greater_than":
+            return lambda row: row[index] is not None and row[index] > value
+        if operator == "less_than":
+            return lambda row: row[index] is not None and row[index] < value
+        if operator == "contains":
+            return lambda row: value is not None and value in str(row[index] or "").lower()
+        if field == "amount":
+            return lambda row: row[index] == value
+        return lambda row: str(row[index] or "").lower() == value
+
+    def route(self, row: Tuple) -> Tuple[List[str], str]:
+        """Walk one expense through the graph; returns the visited nodes and the outcome."""
+        path: List[str] = []
+        node_id = self.start
+        approvals = 0
+        for _ in range(len(self.nodes) + 1):
+            if node_id is None:
+                break
+            node = self.nodes.get(node_id)
+            if node is None:
+                break
+            path.append(node_id)
+            kind = node.get("type")
+            if kind == "end":
+                break
+            if kind == "reject":
+                return path, "rejected"
+            if kind == "approver":
+                approvals += 1
+            if kind == "condition":
+                when_true, when_false = self.branches[node_id]
+                node_id = when_true if self.conditions[node_id](row) else when_false
+            else:
+                node_id = self.next.get(node_id)
+        else:
+            return path, "loop"
+        return path, "routed" if approvals else "auto_approved"
+
+
+def _stats() -> Dict[str, Any]:
+    # depth: per approver, +1/-1 at the day index where expenses start/stop waiting
+    return {"hits": Counter(), "outcomes": Counter(), "depth": defaultdict(Counter)}
+
+
+def _record(stats: Dict[str, Any], compiled: CompiledWorkflow, row: Tuple, path: List[str],
+            outcome: str, origin: float):
+    stats["hits"].update(path)
+    stats["outcomes"][outcome] += 1
+    entered = row[0]
+    for node_id in path:
+        timeout = compiled.timeouts.get(node_id)
+        if timeout is None:
+            continue
+        left = entered + timeout
+        first = math.ceil((entered - origin) / DAY)
+        last = math.ceil((left - origin) / DAY)
+        if last > first:
+            stats["depth"][node_id][first] += 1
+            stats["depth"][node_id][last] -= 1
+        entered = left
+
+
+def _replay(candidate: Dict[str, Any], baseline: Optional[Dict[str, Any]],
+            rows: List[Tuple], origin: float) -> Dict[str, Any]:
+    """Replay a chunk of packed expenses through both graphs. Runs in a worker process."""
+    graphs = [("candidate", CompiledWorkflow(candidate))]
+    if baseline:
+        graphs.append(("baseline", CompiledWorkflow(baseline)))
+    stats = {name: _stats() for name, _ in graphs}
+    changed = 0
+    for row in rows:
+        routes = []
+        for name, compiled in graphs:
+            path, outcome = compiled.route(row)
+            _record(stats[name], compiled, row, path, outcome, origin)
+            approvers = tuple(n for n in path if n in compiled.timeouts)
+            routes.append((outcome, approvers))
+        if len(routes) == 2 and routes[0] != routes[1]:
+            changed += 1
+    return {"stats": stats, "changed": changed}
+
+
+def _merge(parts: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    merged: Dict[str, Any] = {}
+    for part in parts:
+        for name, stats in part.items():
+            into = merged.setdefault(name, _stats())
+            into["hits"].update(stats["hits"])
+            into["outcomes"].update(stats["outcomes"])
+            for node_id, deltas in stats["depth"].items():
+                into["depth"][node_id].update(deltas)
+    return merged
+
+
+def _report(workflow: Dict[str, Any], merged: Dict[str, Any], total: int, origin: float, days: int):
+    names = {node["id"]: node.get("name", node["id"]) for node in workflow.get("nodes", [])}
+    queue_depth, peak = {}, {}
+    for node_id, deltas in merged["depth"].items():
+        series, running = [], 0
+        for day in range(days + 1):
+            running += deltas.get(day, 0)
+            series.append(running)
+        queue_depth[node_id] = series
+        peak[node_id] = max(series) if series else 0
+    auto = merged["outcomes"].get("auto_approved", 0)
+    return {
+        "node_hits": {node_id: merged["hits"].get(node_id, 0) for node_id in names},
+        "node_names": names,
+        "outcomes": dict(merged["outcomes"]),
+        "auto_approval_rate": auto / total if total else 0,
+        "queue_depth": queue_depth,
+        "peak_queue_depth": peak,
+    }
+
+
+def _pool_for(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=workers)
+    return _pool
+
+
+def simulate(candidate: Dict[str, Any], baseline: Optional[Dict[str, Any]], rows: List[Tuple],
+             origin: float, days: int, workers: Optional[int] = None, executor=None) -> Dict[str, Any]:
+    """Replay packed expense rows through `candidate` (and `baseline`) in parallel.
+
+    Rows are split into contiguous chunks, each replayed in a worker process;
+    per-chunk counters are then merged. Queue depth is sampled once a day from
+    `origin` for `days` days.
+    """
+    workers = workers or os.cpu_count() or 1
+    executor = executor or _pool_for(workers)
+    size = max(1, math.ceil(len(rows) / (workers * 4)))
+    chunks = [rows[i:i + size] for i in range(0, len(rows), size)]
+    futures = [executor.submit(_replay, candidate, baseline, chunk, origin) for chunk in chunks]
+    parts = [future.result() for future in futures]
+    # Seeded so an empty range still reports zero counts for each graph
+    seed = {"candidate": _stats(), **({"baseline": _stats()} if baseline else {})}
+    merged = _merge([seed] + [part["stats"] for part in parts])
+
+    total = len(rows)
+    result = {
+        "expenses": total,
+        "candidate": _report(candidate, merged["candidate"], total, origin, days),
+        "baseline": None,
+        "diff": None,
+    }
+    if baseline:
+        result["baseline"] = _report(baseline, merged["baseline"], total, origin, days)
+        cand, base = result["candidate"], result["baseline"]
+        node_ids = set(cand["node_hits"]) | set(base["node_hits"])
+        result["diff"] = {
+            "node_hits": {n: cand["node_hits"].get(n, 0) - base["node_hits"].get(n, 0) for n in sorted(node_ids)},
+            "peak_queue_depth": {
+                n: cand["peak_queue_depth"].get(n, 0) - base["peak_queue_depth"].get(n, 0)
+                for n in sorted(set(cand["peak_queue_depth"]) | set(base["peak_queue_depth"]))
+            },
+            "auto_approval_rate": cand["auto_approval_rate"] - base["auto_approval_rate"],
+            # Expenses whose outcome or approver sequence differs
+            "changed_routes": sum(part["changed"] for part in parts),
+        }
+    return result
@@ -0,0 +1,312 @@
+import json
+import os
+import re
+import shutil
+import time
+from typing import Any, Callable, Dict, Iterator, List, NamedTuple, Optional
+
+from archive import ExpenseArchive, month_of, to_timestamp
+from org_hierarchy import OrgHierarchy
+from search_index import SEARCH_FIELDS, SearchIndex
+from workflow_history import WorkflowHistory
+
+COLLECTIONS = ("users", "workflows", "expenses", "receipts")
+
+# Records created before tenants existed (and requests without a company)
+DEFAULT_TENANT = "default"
+
+TENANT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+class TenantQuota(NamedTuple):
+    requests_per_minute: int = 600
+    max_records: int = 100_000
+    max_bytes: int = 50 * 1024 * 1024
+
+
+class QuotaExceeded(Exception):
+    def __init__(self, detail: str, retry_after: Optional[float] = None):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = retry_after
+
+
+class Tenant:
+    """All data belonging to one company.
+
+    Besides the raw collections a tenant keeps id indexes, running expense
+    aggregates, its own search index and its own expense archive, and is
+    persisted to its own file. Requests for one company never scan, lock or
+    rewrite another company's data.
+    """
+
+    def __init__(self, company_id: str, root: str, archive_root: str, quota: TenantQuota,
+                 hot_cutoff: Callable[[], str] = lambda: "0000-00"):
+        self.company_id = company_id
+        self.path = os.path.join(root, f"{company_id}.json")
+        self.search_path = os.path.join(root, f"{company_id}.search.json")
+        self.archive_root = os.path.join(archive_root, company_id)
+        self.quota = quota
+        self.hot_cutoff = hot_cutoff
+        self.data: Dict[str, List[Dict[str, Any]]] = {c: [] for c in COLLECTIONS}
+        self.by_id: Dict[str, Dict[str, Dict[str, Any]]] = {c: {} for c in COLLECTIONS}
+        self.expense_totals = {"count": 0, "total": 0.0, "by_category": {}}
+        # Month (YYYY-MM) of the oldest hot expense, to notice when it ages out
+        self.oldest_hot_month: Optional[str] = None
+        self.receipts_by_hash: Dict[str, List[Dict[str, Any]]] = {}
+        self.search = SearchIndex()
+        self.org = OrgHierarchy()
+        self.history = WorkflowHistory(os.path.join(root, f"{company_id}.history"))
+        self.stored_bytes = 0
+        # Receipt files count once per distinct hash within the company
+        self.receipt_bytes = 0
+        self._archive: Optional[ExpenseArchive] = None
+        self._tokens = float(quota.requests_per_minute)
+        self._refilled = time.monotonic()
+
+    @property
+    def archive(self) -> ExpenseArchive:
+        # Created on first use so small tenants don't each get a directory
+        if self._archive is None:
+            self._archive = ExpenseArchive(self.archive_root)
+        return self._archive
+
+    def has_archive(self) -> bool:
+        return self._archive is not None or os.path.isdir(self.archive_root)
+
+    # Quotas
+
+    def admit_request(self):
+        """Take one token from the tenant's request bucket."""
+        now = time.monotonic()
+        rate = self.quota.requests_per_minute / 60.0
+        self._tokens = min(self.quota.requests_per_minute, self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens < 1:
+            raise QuotaExceeded("Request quota exceeded", (1 - self._tokens) / rate)
+        self._tokens -= 1
+
+    def record_count(self) -> int:
+        return sum(len(rows) for rows in self.data.values())
+
+    def used_bytes(self) -> int:
+        return self.stored_bytes + self.receipt_bytes + self.history.stored_bytes
+
+    def check_storage(self, extra_bytes: int = 0, new_records: int = 1):
+        if self.record_count() + new_records > self.quota.max_records:
+            raise QuotaExceeded("Record quota exceeded")
+        if self.used_bytes() + extra_bytes >= self.quota.max_bytes:
+            raise QuotaExceeded("Storage quota exceeded")
+
+    # Records
+
+    def get(self, collection: str, record_id: str) -> Optional[Dict[str, Any]]:
+        return self.by_id[collection].get(record_id)
+
+    def add(self, collection: str, record: Dict[str, Any]):
+        record["company_id"] = self.company_id
+        self.data[collection].append(record)
+        self.by_id[collection][record["id"]] = record
+        if collection == "expenses":
+            self._count_expense(record)
+        elif collection == "receipts":
+            self._count_receipt(record)
+        elif collection == "users":
+            self.org.add(record)
+        if collection in SEARCH_FIELDS:
+            self.search.add(collection, record)
+
+    def replace(self, collection: str, record_id: str, record: Dict[str, Any]) -> Dict[str, Any]:
+        """Replace a stored record in place and return the previous version."""
+        stored = self.by_id[collection][record_id]
+        previous = dict(stored)
+        record["company_id"] = self.company_id
+        stored.clear()
+        stored.update(record)
+        if stored["id"] != record_id:
+            del self.by_id[collection][record_id]
+            self.by_id[collection][stored["id"]] = stored
+            if collection in SEARCH_FIELDS:
+                self.search.remove(collection, record_id)
+        if collection in SEARCH_FIELDS:
+            self.search.update(collection, stored)
+        if collection == "users":
+            if stored["id"] != record_id:
+                self.org.remove(record_id)
+            self.org.update(stored, previous)
+        return previous
+
+    def _count_expense(self, expense: Dict[str, Any]):
+        totals = self.expense_totals
+        totals["count"] += 1
+        totals["total"] += expense["amount"]
+        totals["by_category"][expense["category"]] = totals["by_category"].get(expense["category"], 0) + expense["amount"]
+        month = month_of(expense["created_at"])
+        if self.oldest_hot_month is None or month < self.oldest_hot_month:
+            self.oldest_hot_month = month
+
+    def _count_receipt(self, receipt: Dict[str, Any]):
+        same = self.receipts_by_hash.setdefault(receipt["sha256"], [])
+        if not same:
+            self.receipt_bytes += receipt["size"]
+        same.append(receipt)
+
+    def expense_summary(self) -> Dict[str, Any]:
+        """Totals over hot and archived expenses."""
+        summary = self.archive.aggregate() if self.has_archive() else {"count": 0, "total": 0.0, "by_category": {}}
+        by_category = dict(summary["by_category"])
+        for name, amount in self.expense_totals["by_category"].items():
+            by_category[name] = by_category.get(name, 0) + amount
+        return {
+            "count": summary["count"] + self.expense_totals["count"],
+            "total": summary["total"] + self.expense_totals["total"],
+            "by_category": by_category,
+        }
+
+    def search_records(self, query: str, collections: Optional[List[str]] = None, limit: int = 20,
+                       fuzzy: bool = True) -> List[Dict[str, Any]]:
+        """Search results, with the text of archived expenses read back from their segment."""
+        results = self.search.search(query, collections, limit, fuzzy=fuzzy)
+        for result in results:
+            ts = result.pop("ts", None)
+            if ts is not None:
+                expense = self.archive.find(result["id"], ts) or {}
+                result["fields"] = {f: expense.get(f) or "" for f in SEARCH_FIELDS["expenses"]}
+        return results
+
+    # Persistence
+
+    def load(self):
+        with open(self.path, "r") as f:
+            stored = json.load(f)
+        self.stored_bytes = os.path.getsize(self.path)
+        self._index(stored)
+        if self.seal(self.hot_cutoff()):
+            self.save()
+        hot_count = sum(len(self.data[c]) for c in SEARCH_FIELDS)
+        cold_count = len(self.archive) if self.has_archive() else 0
+        # Reuse the persisted index unless it is missing or out of step. Only
+        # a missing or damaged cold part means reading the archive back
+        if not self.search.load(self.search_path) or self.search.frozen != cold_count:
+            cold = self.archive.records() if cold_count else ()
+            self.search.rebuild(self.data, (("expenses", e, to_timestamp(e["created_at"])) for e in cold))
+            self.search.save(self.search_path)
+        elif len(self.search) != hot_count + cold_count:
+            self.search.rebuild(self.data)
+            self.search.save(self.search_path)
+        self._roll_forward()
+
+    def _roll_forward(self):
+        # Workflow patches are only appended to the history log; bring the
+        # stored documents up to the newest logged version
+        for workflow_id in self.history.workflow_ids():
+            stored = self.get("workflows", workflow_id)
+            head = self.history.head(workflow_id)
+            if stored is not None and head > stored.get("version", 1):
+                self.replace("workflows", workflow_id, self.history.version(workflow_id, head))
+
+    def _index(self, stored: Dict[str, List[Dict[str, Any]]]):
+        for collection in COLLECTIONS:
+            rows = stored.get(collection, [])
+            for record in rows:
+                record["company_id"] = self.company_id
+            self.data[collection] = rows
+            self.by_id[collection] = {record["id"]: record for record in rows}
+        self.expense_totals = {"count": 0, "total": 0.0, "by_category": {}}
+        self.oldest_hot_month = None
+        for expense in self.data["expenses"]:
+            self._count_expense(expense)
+        self.receipts_by_hash = {}
+        self.receipt_bytes = 0
+        for receipt in self.data["receipts"]:
+            self._count_receipt(receipt)
+        self.org.rebuild(self.data["users"])
+
+    def seal(self, hot_cutoff: str) -> bool:
+        """Move expenses older than `hot_cutoff` (YYYY-MM) into the archive.
+
+        Returns True if anything was sealed; the caller saves.
+        """
+        if self.oldest_hot_month is None or self.oldest_hot_month >= hot_cutoff:
+            return False
+        hot = self.archive.seal(self.data["expenses"], hot_cutoff)
+        hot_ids = {expense["id"] for expense in hot}
+        for expense in self.data["expenses"]:
+            if expense["id"] not in hot_ids:
+                self.search.freeze("expenses", expense["id"], to_timestamp(expense["created_at"]))
+        self._index({**self.data, "expenses": hot})
+        return True
+
+    def save(self):
+        # Months age out while the server runs; seal them before the hot
+        # data is written so the file and memory don't grow until a restart
+        self.seal(self.hot_cutoff())
+        with open(self.path, "w") as f:
+            json.dump(self.data, f, indent=2)
+        self.stored_bytes = os.path.getsize(self.path)
+        self.search.flush(self.search_path)
+
+
+class TenantStore:
+    """Tenants keyed by company id, loaded from disk on first access."""
+
+    def __init__(self, root: str = "tenants", archive_root: str = "archive",
+                 quota: TenantQuota = TenantQuota(), hot_cutoff: Callable[[], str] = lambda: "0000-00",
+                 seed: Optional[Callable[[Tenant], None]] = None):
+        self.root = root
+        self.archive_root = archive_root
+        self.quota = quota
+        self.hot_cutoff = hot_cutoff
+        self.seed = seed
+        self.tenants: Dict[str, Tenant] = {}
+        os.makedirs(root, exist_ok=True)
+
+    def get(self, company_id: str) -> Tenant:
+        tenant = self.tenants.get(company_id)
+        if tenant is not None:
+            return tenant
+        if not TENANT_ID_RE.match(company_id):
+            raise ValueError(f"Invalid company id: {company_id!r}")
+        tenant = Tenant(company_id, self.root, self.archive_root, self.quota, self.hot_cutoff)
+        if os.path.exists(tenant.path):
+            tenant.load()
+        elif self.seed is not None:
+            self.seed(tenant)
+            tenant.save()
+        self.tenants[company_id] = tenant
+        return tenant
+
+    def company_ids(self) -> Iterator[str]:
+        for name in sorted(os.listdir(self.root)):
+            if name.endswith(".json") and not name.endswith(".search.json"):
+                yield name[:-len(".json")]
+
+    def migrate_legacy(self, db_path: str):
+        """Split a pre-tenant db.json into per-company files.
+
+        Runs only while no tenant files exist. Records without a usable
+        company_id (missing, or not a valid tenant id) go to the default
+        tenant, as do archive segments sealed before tenants existed.
+        """
+        if any(True for _ in self.company_ids()) or not os.path.exists(db_path):
+            return
+        with open(db_path, "r") as f:
+            legacy = json.load(f)
+        partitions: Dict[str, Dict[str, List[Dict[str, Any]]]] = {}
+        for collection in COLLECTIONS:
+            for record in legacy.get(collection, []):
+                company_id = str(record.get("company_id") or DEFAULT_TENANT)
+                if not TENANT_ID_RE.match(company_id):
+                    company_id = DEFAULT_TENANT
+                partitions.setdefault(company_id, {c: [] for c in COLLECTIONS})[collection].append(record)
+        partitions.setdefault(DEFAULT_TENANT, {c: [] for c in COLLECTIONS})
+        for company_id, data in partitions.items():
+            with open(os.path.join(self.root, f"{company_id}.json"), "w") as f:
+                json.dump(data, f, indent=2)
+        legacy_segments = [n for n in os.listdir(self.archive_root)
+                           if os.path.isfile(os.path.join(self.archive_root, n))] if os.path.isdir(self.archive_root) else []
+        if legacy_segments:
+            target = os.path.join(self.archive_root, DEFAULT_TENANT)
+            os.makedirs(target, exist_ok=True)
+            for name in legacy_segments:
+                shutil.move(os.path.join(self.archive_root, name), os.path.join(target, name))
@@ -0,0 +1,210 @@
+import copy
+import json
+import os
+from typing import Any, Dict, List, Optional
+
+# Every SNAPSHOT_EVERY versions the full document is stored with the delta,
+# so rebuilding any version replays at most SNAPSHOT_EVERY - 1 deltas
+SNAPSHOT_EVERY = 20
+
+# Set by the server, not by patches
+READ_ONLY = {"id", "version", "created_at", "updated_at", "company_id"}
+
+# Collections addressed by element id instead of array position, so a
+# patch stays valid while other clients add or remove nodes
+KEYED = {"nodes", "edges"}
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _split(path: str) -> List[str]:
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    return [part.replace("~1", "/").replace("~0", "~") for part in path[1:].split("/")]
+
+
+def _keyed_index(items: List[Dict[str, Any]], key: str) -> Optional[int]:
+    return next((i for i, item in enumerate(items) if item.get("id") == key), None)
+
+
+def _child(container: Any, key: str, keyed: bool, path: str) -> Any:
+    if keyed:
+        index = _keyed_index(container, key)
+        if index is None:
+            raise PatchError(f"No element {key!r} at {path}")
+        return container[index]
+    if isinstance(container, dict):
+        if key not in container:
+            raise PatchError(f"Path not found: {path}")
+        return container[key]
+    if isinstance(container, list):
+        try:
+            return container[int(key)]
+        except (ValueError, IndexError):
+            raise PatchError(f"Path not found: {path}")
+    raise PatchError(f"Path not found: {path}")
+
+
+def _apply_op(doc: Dict[str, Any], op: Dict[str, Any]):
+    kind, path = op.get("op"), op.get("path", "")
+    if kind not in ("add", "remove", "replace", "test"):
+        raise PatchError(f"Unsupported op: {kind!r}")
+    parts = _split(path)
+    if parts[0] in READ_ONLY:
+        raise PatchError(f"{parts[0]} cannot be patched")
+    if kind != "remove" and "value" not in op:
+        raise PatchError(f"{kind} at {path} needs a value")
+    value = copy.deepcopy(op.get("value"))
+
+    parent = doc
+    for depth, key in enumerate(parts[:-1]):
+        parent = _child(parent, key, depth == 1 and parts[0] in KEYED, path)
+    last = parts[-1]
+
+    if len(parts) == 2 and parts[0] in KEYED:
+        # /nodes/<id> or /nodes/- for whole elements
+        index = None if last == "-" else _keyed_index(parent, last)
+        if kind == "add":
+            if not isinstance(value, dict):
+                raise PatchError(f"Value at {path} must be an object")
+            element_id = value.setdefault("id", last) if last != "-" else value.get("id")
+            if element_id is None or _keyed_index(parent, element_id) is not None:
+                raise PatchError(f"Element {element_id!r} already exists at /{parts[0]}")
+            parent.append(value)
+            return
+        if index is None:
+            raise PatchError(f"No element {last!r} at {path}")
+        if kind == "remove":
+            del parent[index]
+        elif kind == "replace":
+            if not isinstance(value, dict) or value.setdefault("id", last) != last:
+                raise PatchError(f"Replacement at {path} must keep id {last!r}")
+            parent[index] = value
+        elif parent[index] != value:
+            raise PatchError(f"Test failed at {path}")
+        return
+
+    if isinstance(parent, dict):
+        if kind in ("remove", "replace", "test") and last not in parent:
+            raise PatchError(f"Path not found: {path}")
+        if kind == "test":
+            if parent[last] != value:
+                raise PatchError(f"Test failed at {path}")
+        elif kind == "remove":
+            del parent[last]
+        else:
+            parent[last] = value
+    elif isinstance(parent, list):
+        if kind == "add" and last == "-":
+            parent.append(value)
+            return
+        try:
+            index = int(last)
+        except ValueError:
+            raise PatchError(f"Invalid array index at {path}")
+        if not 0 <= index < len(parent) + (kind == "add"):
+            raise PatchError(f"Index out of range at {path}")
+        if kind == "add":
+            parent.insert(index, value)
+        elif kind == "remove":
+            del parent[index]
+        elif kind == "replace":
+            parent[index] = value
+        elif parent[index] != value:
+            raise PatchError(f"Test failed at {path}")
+    else:
+        raise PatchError(f"Path not found: {path}")
+
+
+def apply_patch(workflow: Dict[str, Any], ops: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Apply JSON-Patch style ops to a copy of `workflow`.
+
+    Follows RFC 6902 (add, remove, replace, test) except that the second
+    segment under /nodes and /edges is an element id rather than an index,
+    e.g. {"op": "replace", "path": "/nodes/approver1/position", "value": {...}}.
+    All ops apply or none do.
+    """
+    doc = copy.deepcopy(workflow)
+    for op in ops:
+        _apply_op(doc, op)
+    return doc
+
+
+class WorkflowHistory:
+    """Append-only version history for one company's workflows.
+
+    Each workflow has a JSON-lines log (<root>/<workflow_id>.jsonl) holding
+    one entry per version: the ops that produced it and, every
+    SNAPSHOT_EVERY versions (and for full replacements), the whole document.
+    A save appends one line instead of rewriting the tenant file; logs are
+    read on first use and kept in memory.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self._entries: Dict[str, List[Dict[str, Any]]] = {}
+        # Size of the logs on disk, for the tenant's storage quota
+        self.stored_bytes = sum(
+            os.path.getsize(self._path(workflow_id)) for workflow_id in self.workflow_ids()
+        )
+
+    def _path(self, workflow_id: str) -> str:
+        return os.path.join(self.root, f"{workflow_id}.jsonl")
+
+    def entries(self, workflow_id: str) -> List[Dict[str, Any]]:
+        entries = self._entries.get(workflow_id)
+        if entries is None:
+            entries = []
+            if os.path.exists(self._path(workflow_id)):
+                with open(self._path(workflow_id)) as f:
+                    entries = [json.loads(line) for line in f if line.strip()]
+            self._entries[workflow_id] = entries
+        return entries
+
+    def head(self, workflow_id: str) -> int:
+        entries = self.entries(workflow_id)
+        return entries[-1]["version"] if entries else 0
+
+    def workflow_ids(self) -> List[str]:
+        if not os.path.isdir(self.root):
+            return []
+        return [name[:-len(".jsonl")] for name in os.listdir(self.root) if name.endswith(".jsonl")]
+
+    def record(self, workflow: Dict[str, Any], ops: Optional[List[Dict[str, Any]]] = None):
+        """Append `workflow`'s current version, produced by `ops` (None for a full replacement)."""
+        entries = self.entries(workflow["id"])
+        version = workflow["version"]
+        entry: Dict[str, Any] = {"version": version, "updated_at": workflow["updated_at"], "ops": ops}
+        if ops is None or not entries or version % SNAPSHOT_EVERY == 0:
+            entry["snapshot"] = workflow
+        line = json.dumps(entry, separators=(",", ":")) + "\n"
+        os.makedirs(self.root, exist_ok=True)
+        with open(self._path(workflow["id"]), "a") as f:
+            f.write(line)
+        self.stored_bytes += len(line.encode())
+        entries.append(copy.deepcopy(entry))
+
+    def version(self, workflow_id: str, version: int) -> Optional[Dict[str, Any]]:
+        """The workflow as it was at `version`, rebuilt from the nearest snapshot."""
+        entries = self.entries(workflow_id)
+        # Versions are contiguous, so entries can be indexed directly
+        index = version - entries[0]["version"] if entries else -1
+        if not 0 <= index < len(entries):
+            return None
+        start = index
+        while "snapshot" not in entries[start]:
+            start -= 1
+        doc = copy.deepcopy(entries[start]["snapshot"])
+        for entry in entries[start + 1:index + 1]:
+            doc = apply_patch(doc, entry["ops"])
+            doc["version"], doc["updated_at"] = entry["version"], entry["updated_at"]
+        return doc
+
+    def versions(self, workflow_id: str) -> List[Dict[str, Any]]:
+        return [
+            {"version": e["version"], "updated_at": e["updated_at"],
+             "ops": len(e["ops"]) if e["ops"] is not None else None, "snapshot": "snapshot" in e}
+            for e in self.entries(workflow_id)
+        ]
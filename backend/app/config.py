@@ -33,6 +33,13 @@ class Settings(BaseSettings):
     OTP_EXPIRE_MINUTES: int = 15
     OTP_LENGTH: int = 6
     
+    # Admission control for auth endpoints
+    RATE_LIMIT_IP_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_IP_PER_MINUTE", 20))
+    RATE_LIMIT_EMAIL_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_EMAIL_PER_MINUTE", 5))
+    RATE_LIMIT_GLOBAL_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_GLOBAL_PER_MINUTE", 600))
+    BCRYPT_WORKERS: int = int(os.getenv("BCRYPT_WORKERS", 4))
+    BCRYPT_MAX_QUEUE: int = int(os.getenv("BCRYPT_MAX_QUEUE", 32))
+    
     # Frontend
     FRONTEND_URL: str = os.getenv("FRONTEND_URL", "http://localhost:3000")
     
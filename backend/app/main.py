@@ -2,13 +2,14 @@ from fastapi import FastAPI, Depends, HTTPException, status, BackgroundTasks, Re
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
-from datetime import timedelta
+from datetime import datetime, timedelta
 from typing import List, Optional
 import uvicorn
 
 from . import models, schemas, auth, email_service
 from .database import SessionLocal, engine
 from .config import settings
+from .rate_limit import AdmissionController, per_minute
 
 # Create database tables
 models.Base.metadata.create_all(bind=engine)
@@ -49,6 +50,17 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Admission control for the auth endpoints
+admission = AdmissionController(
+    limits={
+        "ip": per_minute(settings.RATE_LIMIT_IP_PER_MINUTE),
+        "email": per_minute(settings.RATE_LIMIT_EMAIL_PER_MINUTE),
+        "global": per_minute(settings.RATE_LIMIT_GLOBAL_PER_MINUTE),
+    },
+    hash_workers=settings.BCRYPT_WORKERS,
+    max_hash_queue=settings.BCRYPT_MAX_QUEUE,
+)
+
 # Dependency
 def get_db():
     db = SessionLocal()
@@ -60,10 +72,13 @@ def get_db():
 # Routes
 @app.post("/register", response_model=schemas.UserResponse)
 async def register(
+    request: Request,
     user_data: schemas.UserCreate, 
     background_tasks: BackgroundTasks, 
     db: Session = Depends(get_db)
 ):
+    admission.check(request, "register", user_data.email, hashing=True)
+    
     # Check if user already exists
     db_user = db.query(models.User).filter(models.User.email == user_data.email).first()
     if db_user:
@@ -84,7 +99,7 @@ async def register(
     db.refresh(company)
     
     # Create user
-    hashed_password = auth.get_password_hash(user_data.password)
+    hashed_password = await admission.run_hashing("register", auth.get_password_hash, user_data.password, shed=False)
     db_user = models.User(
         email=user_data.email,
         hashed_password=hashed_password,
@@ -138,10 +153,13 @@ async def verify_email(
 
 @app.post("/resend-verification")
 async def resend_verification(
+    request: Request,
     email_data: schemas.EmailRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
+    admission.check(request, "resend-verification", email_data.email)
+    
     user = db.query(models.User).filter(models.User.email == email_data.email).first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -157,10 +175,15 @@ async def resend_verification(
 
 @app.post("/token", response_model=schemas.Token)
 async def login_for_access_token(
+    request: Request,
     form_data: OAuth2PasswordRequestForm = Depends(),
     db: Session = Depends(get_db)
 ):
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    admission.check(request, "token", form_data.username, hashing=True)
+    
+    user = await admission.run_hashing(
+        "token", auth.authenticate_user, db, form_data.username, form_data.password, shed=False
+    )
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -181,7 +204,7 @@ async def login_for_access_token(
     # Generate access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth.create_access_token(
-        data={"sub": user.email}, expires_delta=access_token_expires
+        data={"sub": user.email, "company_id": user.company_id}, expires_delta=access_token_expires
     )
     
     return {"access_token": access_token, "token_type": "bearer"}
@@ -204,10 +227,13 @@ async def read_users_me(current_user: models.User = Depends(auth.get_current_act
 
 @app.post("/forgot-password")
 async def forgot_password(
+    request: Request,
     email_data: schemas.EmailRequest,
     background_tasks: BackgroundTasks,
     db: Session = Depends(get_db)
 ):
+    admission.check(request, "forgot-password", email_data.email)
+    
     user = db.query(models.User).filter(models.User.email == email_data.email).first()
     if user:
         # Generate and send password reset OTP
@@ -232,7 +258,7 @@ async def reset_password(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    user.hashed_password = auth.get_password_hash(reset_data.new_password)
+    user.hashed_password = await admission.run_hashing("reset-password", auth.get_password_hash, reset_data.new_password)
     db.commit()
     
     return {"message": "Password updated successfully"}
@@ -244,14 +270,18 @@ async def change_password(
     db: Session = Depends(get_db)
 ):
     # Verify current password
-    if not auth.verify_password(change_data.current_password, current_user.hashed_password):
+    if not await admission.run_hashing("change-password", auth.verify_password, change_data.current_password, current_user.hashed_password):
         raise HTTPException(status_code=400, detail="Incorrect current password")
     
     # Update password
-    current_user.hashed_password = auth.get_password_hash(change_data.new_password)
+    current_user.hashed_password = await admission.run_hashing("change-password", auth.get_password_hash, change_data.new_password)
     db.commit()
     
     return {"message": "Password updated successfully"}
 
+@app.get("/metrics/admission")
+async def admission_metrics():
+    return admission.metrics()
+
 if __name__ == "__main__":
     uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
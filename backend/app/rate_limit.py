@@ -0,0 +1,172 @@
+import asyncio
+import math
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens added per second
+    burst: int   # bucket capacity
+
+
+def per_minute(count: int, burst: Optional[int] = None) -> Limit:
+    return Limit(rate=count / 60.0, burst=burst or count)
+
+
+class BucketStore(ABC):
+    """Storage for token-bucket state.
+
+    The in-memory store is enough for a single process; a shared backend
+    (e.g. Redis with a Lua script doing the same arithmetic) can be plugged in
+    by implementing `take_all`.
+    """
+
+    @abstractmethod
+    def take_all(self, buckets: List[Tuple[str, Limit]], cost: float = 1.0) -> Tuple[Optional[int], float]:
+        """Take `cost` tokens from every bucket, or from none of them.
+
+        Returns (None, 0) if all buckets had enough tokens. Otherwise nothing
+        is taken and the result is the index of the first bucket that was
+        short and the seconds until it will have refilled.
+        """
+
+    def take(self, key: str, limit: Limit, cost: float = 1.0) -> float:
+        return self.take_all([(key, limit)], cost)[1]
+
+
+class InMemoryBucketStore(BucketStore):
+    """Process-local buckets with LRU eviction of idle keys."""
+
+    def __init__(self, max_keys: int = 100_000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _refill(self, key: str, limit: Limit, now: float) -> list:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(limit.burst), now]
+            # An evicted bucket would be full again anyway, so dropping the
+            # least recently used ones never admits more than the limit
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(limit.burst, bucket[0] + (now - bucket[1]) * limit.rate)
+            bucket[1] = now
+        return bucket
+
+    def take_all(self, buckets: List[Tuple[str, Limit]], cost: float = 1.0) -> Tuple[Optional[int], float]:
+        now = time.monotonic()
+        with self._lock:
+            refilled = [self._refill(key, limit, now) for key, limit in buckets]
+            for i, (bucket, (_, limit)) in enumerate(zip(refilled, buckets)):
+                if bucket[0] < cost:
+                    return i, (cost - bucket[0]) / limit.rate
+            for bucket in refilled:
+                bucket[0] -= cost
+            return None, 0.0
+
+
+class AdmissionController:
+    """Rate limits and load shedding for the auth endpoints.
+
+    Each endpoint has token buckets per client IP, per email and globally.
+    Password hashing runs in a bounded thread pool; once too many hashes are
+    queued new work is shed with 429 instead of slowing every request down.
+    A request counts as admitted only once it has passed both.
+    """
+
+    def __init__(
+        self,
+        limits: Dict[str, Limit],
+        store: Optional[BucketStore] = None,
+        hash_workers: int = 4,
+        max_hash_queue: int = 32,
+    ):
+        self.limits = limits
+        self.store = store or InMemoryBucketStore()
+        self.hash_workers = hash_workers
+        self.max_hash_queue = max_hash_queue
+        self.hash_pool = ThreadPoolExecutor(max_workers=hash_workers, thread_name_prefix="bcrypt")
+        self.hash_queue_depth = 0
+        self.avg_hash_seconds = 0.25
+        self.admitted: Dict[str, int] = defaultdict(int)
+        self.rejected: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+
+    def _reject(self, endpoint: str, reason: str, retry_after: float):
+        self.rejected[endpoint][reason] += 1
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many requests, please try again later",
+            headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+        )
+
+    def check(self, request: Request, endpoint: str, email: Optional[str] = None, hashing: bool = False):
+        """Raise 429 if any of the endpoint's buckets is empty.
+
+        Endpoints that go on to hash a password pass `hashing=True` so an
+        overloaded hash pool sheds them here, before any tokens are taken;
+        their later `run_hashing(..., shed=False)` call then always runs.
+        """
+        if hashing:
+            self._shed_if_overloaded(endpoint)
+        # Only the socket address is used; X-Forwarded-For is client controlled
+        client_ip = request.client.host if request.client else "unknown"
+        # All buckets are checked before any is charged, so a rejected request
+        # costs nothing. The client's own IP bucket comes first: a client over
+        # its limit is reported as such and can't drain the bucket of an email
+        # it names or the shared global one
+        scopes = [("ip", f"{endpoint}:ip:{client_ip}")]
+        if email:
+            scopes.append(("email", f"{endpoint}:email:{email.strip().lower()}"))
+        scopes.append(("global", f"{endpoint}:global"))
+        scopes = [(scope, key) for scope, key in scopes if self.limits.get(scope) is not None]
+        failed, retry_after = self.store.take_all([(key, self.limits[scope]) for scope, key in scopes])
+        if failed is not None:
+            self._reject(endpoint, scopes[failed][0], retry_after)
+        self.admitted[endpoint] += 1
+
+    def _shed_if_overloaded(self, endpoint: str):
+        if self.hash_queue_depth >= self.max_hash_queue:
+            backlog = self.hash_queue_depth * self.avg_hash_seconds / self.hash_workers
+            self._reject(endpoint, "overload", backlog)
+
+    async def run_hashing(self, endpoint: str, func: Callable, *args, shed: bool = True):
+        """Run a bcrypt-bound call in the hashing pool, shedding load when it is backed up.
+
+        `shed=False` is for requests already admitted by `check(..., hashing=True)`.
+        """
+        if shed:
+            self._shed_if_overloaded(endpoint)
+
+        def timed():
+            started = time.monotonic()
+            try:
+                return func(*args)
+            finally:
+                elapsed = time.monotonic() - started
+                self.avg_hash_seconds = 0.9 * self.avg_hash_seconds + 0.1 * elapsed
+
+        self.hash_queue_depth += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.hash_pool, timed)
+        finally:
+            self.hash_queue_depth -= 1
+
+    def metrics(self) -> dict:
+        rejected_total = sum(sum(reasons.values()) for reasons in self.rejected.values())
+        return {
+            "admitted": dict(self.admitted),
+            "rejected": {endpoint: dict(reasons) for endpoint, reasons in self.rejected.items()},
+            "admitted_total": sum(self.admitted.values()),
+            "rejected_total": rejected_total,
+            "hash_queue_depth": self.hash_queue_depth,
+            "avg_hash_seconds": round(self.avg_hash_seconds, 4),
+        }
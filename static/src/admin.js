@@ -45,6 +45,24 @@ const api = {
         return await response.json();
     },
     
+    // Send only node/edge deltas; version is the one the edit was based on
+    patchWorkflow: async (id, version, ops) => {
+        const response = await fetch(`${API_BASE_URL}/workflows/${id}`, {
+            method: 'PATCH',
+            headers: { 'Content-Type': 'application/json', 'If-Match': `"${version}"` },
+            body: JSON.stringify({ ops })
+        });
+        if (response.status === 412) {
+            const error = new Error('Workflow was changed by someone else');
+            error.conflict = true;
+            throw error;
+        }
+        if (!response.ok) {
+            throw new Error(`Failed to save workflow (${response.status})`);
+        }
+        return await response.json();
+    },
+    
     // Expenses
     getExpenses: async () => {
         const response = await fetch(`${API_BASE_URL}/expenses`);
@@ -54,9 +72,38 @@ const api = {
     analyzeExpenses: async () => {
         const response = await fetch(`${API_BASE_URL}/expenses/analyze`);
         return await response.json();
+    },
+    
+    // Change feed (SSE) - delivers deltas instead of full reloads.
+    // EventSource resumes automatically from the last event id on reconnect.
+    subscribeChanges: (onEvent, topics = {}, since = null) => {
+        const params = new URLSearchParams(
+            Object.entries(topics).filter(([, value]) => value)
+        );
+        if (since !== null) params.set('since', since);
+        // EventSource can't send an Authorization header
+        const token = sessionStorage.getItem('accessToken');
+        if (token) params.set('token', token);
+        const source = new EventSource(`${API_BASE_URL}/changes?${params}`);
+        ['create', 'update', 'delete', 'resync'].forEach(op => {
+            source.addEventListener(op, e => onEvent(JSON.parse(e.data)));
+        });
+        return source;
     }
 };
 
+// Apply a change-feed delta to one of the local collections
+function applyChange(collection, event) {
+    const index = collection.findIndex(item => item.id === event.id);
+    if (event.op === 'delete') {
+        if (index !== -1) collection.splice(index, 1);
+    } else if (index === -1) {
+        collection.push({ id: event.id, ...event.data });
+    } else {
+        Object.assign(collection[index], event.data);
+    }
+}
+
 document.addEventListener('DOMContentLoaded', async function() {
     console.log('🚀 Admin panel initializing...');
     
@@ -610,8 +657,16 @@ function loadWorkflowTemplate(templateId) {
             break;
     }
     
-    // Render nodes
+    renderWorkflowNodes(nodes);
+    
+    // Show success message
+    showNotification('Workflow template loaded successfully', 'success');
+}
+
+// Draw workflow nodes (from a template or the server) onto the canvas
+function renderWorkflowNodes(nodes) {
     const workflowNodes = document.getElementById('workflowNodes');
+    workflowNodes.innerHTML = '';
     nodes.forEach((node, index) => {
         const nodeEl = document.createElement('div');
         nodeEl.className = 'workflow-node';
@@ -630,11 +685,12 @@ function loadWorkflowTemplate(templateId) {
                     </div>
                 </div>
                 <div class="node-content">
-                    <div><i class="fas fa-user-tie"></i> ${node.approvers.join(', ')}</div>
+                    <div><i class="fas fa-user-tie"></i> ${(node.approvers || node.data?.approvers || []).join(', ')}</div>
                     ${node.condition ? `<div class="node-condition"><i class="fas fa-code-branch"></i> ${node.condition}</div>` : ''}
                 </div>
             `;
         } else if (node.type === 'condition') {
+            const condition = node.condition || node.data?.condition || {};
             nodeContent = `
                 <div class="node-header">
                     <div class="node-title">${node.name}</div>
@@ -644,7 +700,13 @@ function loadWorkflowTemplate(templateId) {
                     </div>
                 </div>
                 <div class="node-content">
-                    <div><i class="fas fa-code-branch"></i> ${node.condition.type} ${node.condition.operator} ${node.condition.value}</div>
+                    <div><i class="fas fa-code-branch"></i> ${condition.type || ''} ${condition.operator || ''} ${condition.value ?? ''}</div>
+                </div>
+            `;
+        } else {
+            nodeContent = `
+                <div class="node-header">
+                    <div class="node-title">${node.name}</div>
                 </div>
             `;
         }
@@ -663,11 +725,7 @@ function loadWorkflowTemplate(templateId) {
         }
     });
     
-    // Update connectors
     updateConnectors();
-    
-    // Show success message
-    showNotification('Workflow template loaded successfully', 'success');
 }
 
 // Save workflow
@@ -697,9 +755,37 @@ async function saveWorkflow() {
             });
         });
         
-        // Save to backend
-        const result = await api.saveWorkflow(workflowData);
+        // Save to backend: deltas against the last saved version when we have one
+        const saved = window.savedWorkflow;
+        let result;
+        if (saved && saved.id === workflowData.id) {
+            const ops = diffWorkflow(saved, workflowData);
+            try {
+                result = ops.length ? await api.patchWorkflow(saved.id, saved.version, ops) : saved;
+            } catch (error) {
+                if (!error.conflict) throw error;
+                // Someone saved first: replay only our own edits on their version
+                const latest = (await api.getWorkflows()).find(w => w.id === saved.id);
+                if (!latest) throw error;
+                try {
+                    result = await api.patchWorkflow(saved.id, latest.version, ops);
+                } catch (rebaseError) {
+                    // Our edits don't apply to their version; show theirs so
+                    // the next save can't silently undo it
+                    window.savedWorkflow = latest;
+                    renderWorkflowNodes(latest.nodes);
+                    showNotification('Workflow was changed by someone else and your edits conflict with theirs. The latest version is now shown; your edits were not saved.', 'error');
+                    return;
+                }
+                // The canvas lacks their changes; show the merged result so
+                // later diffs don't revert them
+                renderWorkflowNodes(result.nodes);
+            }
+        } else {
+            result = await api.saveWorkflow(workflowData);
+        }
         window.currentWorkflowId = result.id;
+        window.savedWorkflow = result;
         
         showNotification('Workflow saved successfully', 'success');
     } catch (error) {
@@ -708,6 +794,43 @@ async function saveWorkflow() {
     }
 }
 
+// RFC 6901 escaping for one path segment
+function escapePointer(segment) {
+    return String(segment).replace(/~/g, '~0').replace(/\//g, '~1');
+}
+
+// JSON-Patch style ops turning `saved` into `current`; nodes and edges are addressed by id
+function diffWorkflow(saved, current) {
+    const ops = [];
+    if (saved.name !== current.name) {
+        ops.push({ op: 'replace', path: '/name', value: current.name });
+    }
+    ['nodes', 'edges'].forEach(collection => {
+        const before = new Map((saved[collection] || []).map(item => [item.id, item]));
+        const after = new Map((current[collection] || []).map(item => [item.id, item]));
+        before.forEach((item, id) => {
+            if (!after.has(id)) ops.push({ op: 'remove', path: `/${collection}/${escapePointer(id)}` });
+        });
+        after.forEach((item, id) => {
+            const old = before.get(id);
+            if (!old) {
+                ops.push({ op: 'add', path: `/${collection}/-`, value: item });
+                return;
+            }
+            const base = `/${collection}/${escapePointer(id)}`;
+            Object.keys(item).forEach(key => {
+                if (JSON.stringify(item[key]) !== JSON.stringify(old[key])) {
+                    ops.push({ op: key in old ? 'replace' : 'add', path: `${base}/${escapePointer(key)}`, value: item[key] });
+                }
+            });
+            Object.keys(old).forEach(key => {
+                if (!(key in item)) ops.push({ op: 'remove', path: `${base}/${escapePointer(key)}` });
+            });
+        });
+    });
+    return ops;
+}
+
 // Create new workflow
 function createNewWorkflow() {
     console.log('Creating new workflow...');
@@ -715,6 +838,7 @@ function createNewWorkflow() {
     if (confirm('Create a new workflow? Any unsaved changes will be lost.')) {
         // Reset workflow state
         window.currentWorkflowId = null;
+        window.savedWorkflow = null;
         
         // Clear workflow canvas
         const workflowNodes = document.getElementById('workflowNodes');
@@ -1531,6 +1655,76 @@ async function loadInitialData() {
         renderUsersTable();
     }
     
+    // Keep collections current from the change feed instead of re-fetching
+    try {
+        let changeSeq = null;
+        let changeCursor = null;  // "<epoch>.<seq>", so a restarted server can tell our cursor is stale
+        let queued = null;  // events that arrive while a resync reload is in flight
+
+        const handleChange = event => {
+            if (event.collection === 'users' && window.users) {
+                applyChange(window.users, event);
+                renderUsersTable();
+            } else if (event.collection === 'workflows') {
+                applyChange(workflows, event);
+            } else if (event.collection === 'expenses') {
+                applyChange(expenses, event);
+            }
+        };
+
+        const resync = async (seq, cursor) => {
+            // Missed too many events; reload every subscribed collection once
+            queued = [];
+            try {
+                const [userData, workflowData, expenseData] = await Promise.all([
+                    api.getUsers(), api.getWorkflows(), api.getExpenses()
+                ]);
+                window.users = userData;
+                workflows = workflowData;
+                expenses = expenseData;
+                changeSeq = seq;
+                changeCursor = cursor;
+                queued.filter(event => event.seq > seq).forEach(event => {
+                    changeSeq = event.seq;
+                    changeCursor = event.cursor;
+                    handleChange(event);
+                });
+                renderUsersTable();
+            } catch (error) {
+                console.warn('Resync failed:', error);
+            } finally {
+                queued = null;
+            }
+        };
+
+        const onEvent = event => {
+            if (event.op === 'resync') {
+                resync(event.seq, event.cursor);
+                return;
+            }
+            if (queued) {
+                queued.push(event);
+                return;
+            }
+            changeSeq = event.seq;
+            changeCursor = event.cursor;
+            handleChange(event);
+        };
+
+        // EventSource retries on its own with Last-Event-ID; if it gives up,
+        // reconnect from the last cursor we applied
+        const connect = () => {
+            const source = api.subscribeChanges(onEvent, { collection: 'users,workflows,expenses' }, changeCursor);
+            source.onerror = () => {
+                if (source.readyState === EventSource.CLOSED) setTimeout(connect, 3000);
+            };
+            window.changeFeed = source;
+        };
+        connect();
+    } catch (error) {
+        console.warn('Change feed unavailable:', error);
+    }
+    
     showNotification('Admin dashboard loaded successfully', 'success');
 }
 